@@ -2,11 +2,37 @@ import os
 import argparse
 import sys
 import shutil
+import re
+import stat
+import mmap
+import json
+import time
+import zlib
+import struct
+import hashlib
+import threading
+import signal
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from ..utils import error
+from ..records import Table
+from .. import fmt
 
 class Command:
+    # if False, arguments are passed through without variable substitution
+    expand_args = True
+    # if False, substituted arguments skip brace and glob expansion and keep their quotes
+    expand_globs = True
+
     def __call__(self, context, *args):
         raise NotImplementedError
+
+    def accepts(self, args) -> bool:
+        """whether the builtin takes these arguments, else a program of the same name on PATH runs"""
+        return True
+
+    # commands that define `query(context, *args)` can be bound, `x = ls -l`,
+    # and return a `records.Table` or None on error
     
 class FallbackCommand(Command):
     pass
@@ -62,31 +88,110 @@ class history(Command):
         for i in range(len(context.history)-1):
             print(f'{i+1}  {context.history[i]}')
 
+    def query(self, context, *args):
+        history = context.history
+        # the last entry is the line being run
+        rows = ((i + 1, history[i]) for i in range(len(history) - 1))
+        return Table([('index', 'q'), ('line', 's')], rows).load()
+
 class ls(FallbackCommand):
+    schema = [('name', 's'), ('size', 'q'), ('mtime', 'd'), ('mode', 'I'), ('is_dir', 'b')]
+
     def __init__(self):
         self.parser = argparse.ArgumentParser(prog='ls')
-        self.parser.add_argument('path', nargs='?', default='.')
+        self.parser.add_argument('paths', nargs='*', default=['.'])
         self.parser.add_argument('-a', action='store_true', help='show hidden files')
+        self.parser.add_argument('-l', action='store_true', help='long listing with mode, size and mtime')
+
+    def _split(self, paths):
+        files = []
+        dirs = []
+        for path in paths:
+            if not os.path.lexists(path):
+                error(f'ls: cannot access {repr(path)}: No such file or directory')
+            elif os.path.isdir(path):
+                dirs.append(path)
+            else:
+                files.append(path)
+        return files, dirs
+
+    @staticmethod
+    def _entries(path: str, all_: bool):
+        """`(name, stat, is_dir)` for each entry of a directory, in directory order"""
+        try:
+            it = os.scandir(path)
+        except OSError as e:
+            error(f'ls: cannot open directory {repr(path)}: {e.strerror}')
+            return
+        with it:
+            for entry in it:
+                if entry.name.startswith('.') and not all_:
+                    continue
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                yield entry.name, st, is_dir
+
+    def _rows(self, files, dirs, all_: bool, prefix: bool):
+        """`files` and `dirs` are `(shown, path)` pairs, `path` is what gets scanned"""
+        for shown, path in files:
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            yield shown, st.st_size, st.st_mtime, st.st_mode, False
+        for path, root in dirs:
+            for name, st, is_dir in self._entries(root, all_):
+                if prefix:
+                    name = os.path.join(path, name)
+                yield name, st.st_size, st.st_mtime, st.st_mode, is_dir
+
+    def query(self, context, *args):
+        try:
+            args = self.parser.parse_args(args)
+        except SystemExit:
+            return None
+        files, dirs = self._split(args.paths)
+        prefix = len(args.paths) > 1 or bool(files)
+        # the names stay as typed, the scan does not depend on a later `cd`
+        files = [(path, os.path.abspath(path)) for path in files]
+        dirs = [(path, os.path.abspath(path)) for path in dirs]
+        return Table(self.schema, self._rows(files, dirs, args.a, prefix)).load()
 
     def __call__(self, context, *args):
         try:
             args = self.parser.parse_args(args)
         except SystemExit:
             return
-        path = args.path
-        if not os.path.exists(path):
-            error(f'ls: cannot access {repr(path)}: No such file or directory')
-            return
-        if not os.path.isdir(path):
-            error(f'ls: cannot access {repr(path)}: Not a directory')
-            return
-        names = []
-        for name in sorted(os.listdir(path)):
-            if name.startswith('.') and not args.a:
-                continue
-            if os.path.isdir(os.path.join(path, name)):
+        files, dirs = self._split(args.paths)
+        show = self._print_long if args.l else self._print_short
+        if files:
+            show(list(self._rows([(p, p) for p in files], [], args.a, True)))
+        for i, path in enumerate(dirs):
+            if len(args.paths) > 1:
+                if files or i > 0:
+                    print()
+                print(f'{path}:')
+            show(list(self._rows([], [(path, path)], args.a, False)))
+
+    def _print_short(self, rows):
+        names = [name + '/' if is_dir else name for name, _, _, _, is_dir in sorted(rows)]
+        self._print_grid(names)
+
+    @staticmethod
+    def _print_long(rows):
+        rows = sorted(rows)
+        width = max((len(str(row[1])) for row in rows), default=0)
+        for name, size, mtime, mode, is_dir in rows:
+            when = time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime))
+            if is_dir:
                 name += '/'
-            names.append(name)
+            print(f'{stat.filemode(mode)}  {str(size).rjust(width)}  {when}  {name}')
+
+    @staticmethod
+    def _print_grid(names):
         if len(names) == 0:
             print()
             return
@@ -114,7 +219,7 @@ class cp(FallbackCommand):
     def __init__(self):
         self.parser = argparse.ArgumentParser(prog='cp')
         self.parser.add_argument('-r', action='store_true', help='copy directories recursively')
-        self.parser.add_argument('src')
+        self.parser.add_argument('src', nargs='+')
         self.parser.add_argument('dst')
 
     def __call__(self, context, *args):
@@ -122,23 +227,29 @@ class cp(FallbackCommand):
             args = self.parser.parse_args(args)
         except SystemExit:
             return
-        src = args.src
         dst = args.dst
-        if not os.path.exists(src):
-            error(f'cp: cannot stat {repr(src)}: No such file or directory')
+        if len(args.src) > 1 and not os.path.isdir(dst):
+            error(f'cp: target {repr(dst)} is not a directory')
             return
-        if os.path.isdir(src) and not args.r:
-            error(f'cp: cannot copy directory {repr(src)} without -r')
-            return
-        if os.path.isdir(src):
-            shutil.copytree(src, dst)
-        else:
-            shutil.copy(src, dst)
+        for src in args.src:
+            if not os.path.exists(src):
+                error(f'cp: cannot stat {repr(src)}: No such file or directory')
+                continue
+            if os.path.isdir(src) and not args.r:
+                error(f'cp: cannot copy directory {repr(src)} without -r')
+                continue
+            if os.path.isdir(src):
+                target = dst
+                if os.path.isdir(dst):
+                    target = os.path.join(dst, os.path.basename(os.path.normpath(src)))
+                shutil.copytree(src, target)
+            else:
+                shutil.copy(src, dst)
 
 class mv(FallbackCommand):
     def __init__(self):
         self.parser = argparse.ArgumentParser(prog='mv')
-        self.parser.add_argument('src')
+        self.parser.add_argument('src', nargs='+')
         self.parser.add_argument('dst')
 
     def __call__(self, context, *args):
@@ -146,57 +257,478 @@ class mv(FallbackCommand):
             args = self.parser.parse_args(args)
         except SystemExit:
             return
-        src = args.src
         dst = args.dst
-        if not os.path.exists(src):
-            error(f'mv: cannot stat {repr(src)}: No such file or directory')
+        if len(args.src) > 1 and not os.path.isdir(dst):
+            error(f'mv: target {repr(dst)} is not a directory')
             return
-        shutil.move(src, dst)
+        for src in args.src:
+            if not os.path.exists(src):
+                error(f'mv: cannot stat {repr(src)}: No such file or directory')
+                continue
+            target = dst
+            if os.path.isdir(dst):
+                target = os.path.join(dst, os.path.basename(os.path.normpath(src)))
+            shutil.move(src, target)
 
-class cat(Command):
+_ARCHIVE_BLOCK = 1 << 20
+# gzip header: magic, deflate, no flags, mtime, no extra flags, unknown os
+_GZIP_HEADER = struct.Struct('<4sIBB')
+
+def _archive_format(path: str):
+    name = path.lower()
+    for suffix, fmt_ in (('.tar.gz', 'tar.gz'), ('.tgz', 'tar.gz'), ('.tar', 'tar'), ('.zip', 'zip')):
+        if name.endswith(suffix):
+            return fmt_
+    return None
+
+def _deflate_block(block: bytes, dictionary: bytes, level: int) -> bytes:
+    if dictionary:
+        c = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionary)
+    else:
+        c = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return c.compress(block) + c.flush(zlib.Z_SYNC_FLUSH)
+
+class _GzipBlockWriter:
+    """a gzip stream compressed in independent blocks on a thread pool, like pigz
+
+    every block is raw deflate primed with the last 32 KiB of the block before it and ends
+    with a sync flush, so the blocks concatenate into one deflate stream
+    """
+    def __init__(self, raw, pool, level: int, window: int):
+        self.raw = raw
+        self.pool = pool
+        self.level = level
+        self.window = window
+        self.buffer = bytearray()
+        self.pending = deque()
+        self.dictionary = b''
+        self.crc = 0
+        self.size = 0
+        raw.write(_GZIP_HEADER.pack(b'\x1f\x8b\x08\x00', int(time.time()), 0, 255))
+
+    def write(self, data) -> int:
+        self.buffer += data
+        while len(self.buffer) >= _ARCHIVE_BLOCK:
+            self._submit(bytes(self.buffer[:_ARCHIVE_BLOCK]))
+            del self.buffer[:_ARCHIVE_BLOCK]
+        return len(data)
+
+    def _submit(self, block: bytes):
+        # crc32 releases the GIL too, it runs while the workers compress
+        self.crc = zlib.crc32(block, self.crc)
+        self.size += len(block)
+        self.pending.append(self.pool.submit(_deflate_block, block, self.dictionary, self.level))
+        self.dictionary = block[-32768:]
+        while self.pending and (len(self.pending) > self.window or self.pending[0].done()):
+            self.raw.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.buffer:
+            self._submit(bytes(self.buffer))
+            self.buffer.clear()
+        while self.pending:
+            self.raw.write(self.pending.popleft().result())
+        # an empty final block, then the trailer
+        self.raw.write(b'\x03\x00' + struct.pack('<II', self.crc & 0xffffffff, self.size & 0xffffffff))
+
+class _Progress:
+    """a `wget`-style progress line with throughput, redrawn at most every 0.1s"""
+    def __init__(self, total: int, enabled: bool = True):
+        self.total = total
+        self.done = 0
+        self.enabled = enabled
+        self.start = time.monotonic()
+        self.last = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, n: int):
+        with self.lock:
+            self.done += n
+            now = time.monotonic()
+            if self.enabled and now - self.last >= 0.1:
+                self.last = now
+                self._print(now, '\r')
+
+    def _print(self, now: float, end: str):
+        rate = self.done / max(now - self.start, 1e-6)
+        percent = self.done / self.total * 100 if self.total else 100.0
+        size_0 = to_human_readable_size(self.done).rjust(5)
+        size_1 = to_human_readable_size(self.total)
+        print(f'{size_0} / {size_1} ({percent:.2f}%) {to_human_readable_size(rate)}/s', end=end, flush=True)
+
+    def finish(self):
+        if self.enabled:
+            self._print(time.monotonic(), '\n')
+
+class _ProgressReader:
+    def __init__(self, f, progress: _Progress):
+        self.f = f
+        self.progress = progress
+
+    def read(self, n=-1):
+        data = self.f.read(n)
+        self.progress.add(len(data))
+        return data
+
+def _pack_entries(paths, skip: str):
+    """yield `(path, arcname, size)`, a directory comes before its contents"""
+    for path in paths:
+        top = os.path.basename(os.path.normpath(os.path.abspath(path)))
+        if not os.path.isdir(path) or os.path.islink(path):
+            yield path, top, os.lstat(path).st_size
+            continue
+        yield path, top, 0
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            rel = os.path.relpath(root, path)
+            prefix = top if rel == '.' else os.path.join(top, rel)
+            for name in sorted(files) + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+                p = os.path.join(root, name)
+                if os.path.abspath(p) == skip:
+                    continue
+                try:
+                    size = os.lstat(p).st_size
+                except OSError:
+                    continue
+                yield p, os.path.join(prefix, name).replace(os.sep, '/'), size
+            for d in dirs:
+                if not os.path.islink(os.path.join(root, d)):
+                    yield os.path.join(root, d), os.path.join(prefix, d).replace(os.sep, '/'), 0
+
+class pack(Command):
     def __init__(self):
-        self.parser = argparse.ArgumentParser(prog='cat')
-        self.parser.add_argument('path')
+        self.parser = argparse.ArgumentParser(prog='pack')
+        self.parser.add_argument('archive', help='.tar, .tar.gz, .tgz or .zip')
+        self.parser.add_argument('paths', nargs='+')
+        self.parser.add_argument('-f', '--format', choices=['tar', 'tar.gz', 'zip'], help='default from the archive name')
+        self.parser.add_argument('-l', '--level', type=int, default=6, help='compression level 0-9 (default 6)')
+        self.parser.add_argument('-j', type=int, default=os.cpu_count() or 4, help='number of compression threads')
+        self.parser.add_argument('-q', '--quiet', action='store_true', help='no progress')
 
     def __call__(self, context, *args):
         try:
             args = self.parser.parse_args(args)
         except SystemExit:
             return
-        path = args.path
-        if not os.path.exists(path):
-            error(f'cat: cannot stat {repr(path)}: No such file or directory')
+        fmt_ = args.format or _archive_format(args.archive)
+        if fmt_ is None:
+            error(f'pack: cannot tell the format of {repr(args.archive)}, use -f')
+            return
+        for path in args.paths:
+            if not os.path.lexists(path):
+                error(f'pack: {path}: No such file or directory')
+                return
+        entries = list(_pack_entries(args.paths, os.path.abspath(args.archive)))
+        progress = _Progress(sum(size for _, _, size in entries), not args.quiet)
+        try:
+            raw = open(args.archive, 'wb')
+        except OSError as e:
+            error(f'pack: {args.archive}: {e.strerror}')
+            return
+        try:
+            with raw:
+                if fmt_ == 'zip':
+                    self._zip(raw, entries, args.level, progress)
+                else:
+                    with ThreadPoolExecutor(max(args.j, 1)) as pool:
+                        out = _GzipBlockWriter(raw, pool, args.level, args.j * 2) if fmt_ == 'tar.gz' else raw
+                        self._tar(out, entries, progress)
+                        if out is not raw:
+                            out.close()
+        except BaseException as e:
+            # a partial archive is worse than none, only the file opened above is removed
+            try:
+                os.remove(args.archive)
+            except OSError:
+                pass
+            if not isinstance(e, OSError):
+                raise
+            error(f'pack: {args.archive}: {e.strerror or e}')
+            return
+        progress.finish()
+
+    @staticmethod
+    def _tar(out, entries, progress: _Progress):
+        import tarfile
+        with tarfile.open(fileobj=out, mode='w|') as tf:
+            for path, arcname, _ in entries:
+                try:
+                    info = tf.gettarinfo(path, arcname)
+                    if info.isfile():
+                        with open(path, 'rb') as f:
+                            tf.addfile(info, _ProgressReader(f, progress))
+                    else:
+                        tf.addfile(info)
+                except OSError as e:
+                    error(f'pack: {path}: {e.strerror}')
+
+    @staticmethod
+    def _zip(raw, entries, level: int, progress: _Progress):
+        import zipfile
+        with zipfile.ZipFile(raw, 'w', zipfile.ZIP_DEFLATED, compresslevel=level) as zf:
+            for path, arcname, _ in entries:
+                try:
+                    info = zipfile.ZipInfo.from_file(path, arcname)
+                    if info.is_dir():
+                        zf.writestr(info, b'')
+                        continue
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    with open(path, 'rb') as src, zf.open(info, 'w', force_zip64=info.file_size > zipfile.ZIP64_LIMIT) as dst:
+                        while True:
+                            data = src.read(_ARCHIVE_BLOCK)
+                            if not data:
+                                break
+                            dst.write(data)
+                            progress.add(len(data))
+                except OSError as e:
+                    error(f'pack: {path}: {e.strerror}')
+
+def _inside(root: str, path: str) -> bool:
+    """whether `path` resolves into `root`, a realpath, following symlinks already extracted"""
+    path = os.path.realpath(path)
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+def _safe_target(dest: str, name: str):
+    """the extraction path of an archive member, None if it would land outside `dest`"""
+    name = name.replace('\\', '/')
+    if name.startswith('/') or os.path.isabs(name):
+        return None
+    parts = [p for p in name.split('/') if p not in ('', '.')]
+    if not parts or '..' in parts:
+        return None
+    target = os.path.join(dest, *parts)
+    # an earlier member may have made a parent a symlink
+    if not _inside(dest, os.path.dirname(target)):
+        return None
+    return target
+
+def _write_member(target: str, data: bytes, mode, mtime):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.islink(target):
+        os.remove(target)
+    with open(target, 'wb') as f:
+        f.write(data)
+    if mode is not None:
+        os.chmod(target, mode)
+    if mtime is not None:
+        os.utime(target, (mtime, mtime))
+    return len(data)
+
+class unpack(Command):
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(prog='unpack')
+        self.parser.add_argument('archive')
+        self.parser.add_argument('-C', dest='dest', default='.', help='extract into this directory')
+        self.parser.add_argument('-j', type=int, default=os.cpu_count() or 4, help='number of writer threads')
+        self.parser.add_argument('-q', '--quiet', action='store_true', help='no progress')
+
+    def __call__(self, context, *args):
+        try:
+            args = self.parser.parse_args(args)
+        except SystemExit:
+            return
+        try:
+            with open(args.archive, 'rb') as f:
+                magic = f.read(4)
+        except OSError as e:
+            error(f'unpack: {args.archive}: {e.strerror}')
             return
-        if os.path.isdir(path):
-            error(f'cat: {repr(path)}: Is a directory')
+        os.makedirs(args.dest, exist_ok=True)
+        dest = os.path.realpath(args.dest)
+        with ThreadPoolExecutor(max(args.j, 1)) as pool:
+            if magic.startswith(b'PK'):
+                self._zip(args, dest, pool)
+            else:
+                self._tar(args, dest, pool, gz=magic.startswith(b'\x1f\x8b'))
+
+    @staticmethod
+    def _tar(args, dest: str, pool, gz: bool):
+        import tarfile
+        progress = _Progress(os.path.getsize(args.archive), not args.quiet)
+        pending = deque()
+        in_flight = {}
+        budget = [0]
+
+        def wait_oldest():
+            target, future, size = pending.popleft()
+            budget[0] -= size
+            if in_flight.get(target) is future:
+                del in_flight[target]
+            try:
+                future.result()
+            except OSError as e:
+                error(f'unpack: {target}: {e.strerror}')
+
+        def drain():
+            while pending:
+                wait_oldest()
+
+        dirs = []
+        with open(args.archive, 'rb') as raw:
+            try:
+                tf = tarfile.open(fileobj=_ProgressReader(raw, progress), mode='r|gz' if gz else 'r|')
+            except tarfile.TarError as e:
+                error(f'unpack: {args.archive}: {e}')
+                return
+            with tf:
+                for member in tf:
+                    target = _safe_target(dest, member.name)
+                    if target is None:
+                        error(f'unpack: skipping {repr(member.name)}, it is outside the destination')
+                        continue
+                    if target in in_flight:
+                        # the same name twice, the later one wins
+                        drain()
+                    if member.isdir():
+                        if not _inside(dest, target):
+                            error(f'unpack: skipping {repr(member.name)}, it is outside the destination')
+                            continue
+                        os.makedirs(target, exist_ok=True)
+                        dirs.append((target, member))
+                    elif member.isfile():
+                        src = tf.extractfile(member)
+                        if member.size <= 8 * _ARCHIVE_BLOCK:
+                            # small files are written by the pool while the stream is decompressed
+                            future = pool.submit(_write_member, target, src.read(), member.mode, member.mtime)
+                            pending.append((target, future, member.size))
+                            in_flight[target] = future
+                            budget[0] += member.size
+                            while budget[0] > 64 * _ARCHIVE_BLOCK or (pending and pending[0][1].done()):
+                                wait_oldest()
+                        else:
+                            os.makedirs(os.path.dirname(target), exist_ok=True)
+                            if os.path.islink(target):
+                                os.remove(target)
+                            with open(target, 'wb') as f:
+                                shutil.copyfileobj(src, f, _ARCHIVE_BLOCK)
+                            os.chmod(target, member.mode)
+                            os.utime(target, (member.mtime, member.mtime))
+                    elif member.issym():
+                        link = os.path.join(os.path.dirname(target), member.linkname)
+                        if os.path.isabs(member.linkname) or not _inside(dest, link):
+                            error(f'unpack: skipping symlink {repr(member.name)} -> {repr(member.linkname)}')
+                            continue
+                        drain()
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        if os.path.lexists(target):
+                            os.remove(target)
+                        os.symlink(member.linkname, target)
+                    elif member.islnk():
+                        source = _safe_target(dest, member.linkname)
+                        if source is None or not _inside(dest, source):
+                            error(f'unpack: skipping hard link {repr(member.name)} -> {repr(member.linkname)}')
+                            continue
+                        drain()
+                        if os.path.lexists(target):
+                            os.remove(target)
+                        os.link(source, target)
+                    else:
+                        error(f'unpack: skipping special file {repr(member.name)}')
+                drain()
+        # after the files, writing into a directory changes its mtime
+        for target, member in reversed(dirs):
+            os.chmod(target, member.mode)
+            os.utime(target, (member.mtime, member.mtime))
+        progress.finish()
+
+    @staticmethod
+    def _zip(args, dest: str, pool):
+        import zipfile
+        local = threading.local()
+        handles = []
+
+        def extract(info, target):
+            # one handle per thread, so members decompress in parallel
+            zf = getattr(local, 'zf', None)
+            if zf is None:
+                zf = local.zf = zipfile.ZipFile(args.archive)
+                handles.append(zf)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with zf.open(info) as src, open(target, 'wb') as dst:
+                shutil.copyfileobj(src, dst, _ARCHIVE_BLOCK)
+            mode = info.external_attr >> 16 & 0o7777
+            if mode:
+                os.chmod(target, mode)
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            os.utime(target, (mtime, mtime))
+            return info.compress_size
+
+        try:
+            with zipfile.ZipFile(args.archive) as zf:
+                infos = zf.infolist()
+        except zipfile.BadZipFile as e:
+            error(f'unpack: {args.archive}: {e}')
+            return
+        progress = _Progress(sum(i.compress_size for i in infos), not args.quiet)
+        jobs = {}
+        for info in infos:
+            target = _safe_target(dest, info.filename)
+            if target is None:
+                error(f'unpack: skipping {repr(info.filename)}, it is outside the destination')
+            elif info.is_dir():
+                os.makedirs(target, exist_ok=True)
+            else:
+                # a repeated name overwrites the earlier member
+                jobs[target] = info
+        futures = [(target, pool.submit(extract, info, target)) for target, info in jobs.items()]
+        try:
+            for target, future in futures:
+                try:
+                    progress.add(future.result())
+                except (OSError, zipfile.BadZipFile) as e:
+                    error(f'unpack: {target}: {e}')
+        finally:
+            for future in futures:
+                future[1].cancel()
+            pool.shutdown()
+            for zf in handles:
+                zf.close()
+        progress.finish()
+
+class cat(Command):
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(prog='cat')
+        self.parser.add_argument('paths', nargs='+')
+
+    def __call__(self, context, *args):
+        try:
+            args = self.parser.parse_args(args)
+        except SystemExit:
             return
-        with open(path) as f:
-            print(f.read())
+        for path in args.paths:
+            if not os.path.exists(path):
+                error(f'cat: cannot stat {repr(path)}: No such file or directory')
+                continue
+            if os.path.isdir(path):
+                error(f'cat: {repr(path)}: Is a directory')
+                continue
+            with open(path) as f:
+                print(f.read())
 
 class rm(FallbackCommand):
     def __init__(self):
         self.parser = argparse.ArgumentParser(prog='rm')
         self.parser.add_argument('-r', action='store_true', help='remove directories and their contents recursively')
         self.parser.add_argument('-f', action='store_true', help='ignore nonexistent files and arguments, never prompt')
-        self.parser.add_argument('path')
+        self.parser.add_argument('paths', nargs='+')
 
     def __call__(self, context, *args):
         try:
             args = self.parser.parse_args(args)
         except SystemExit:
             return
-        path = args.path
-        if not os.path.exists(path):
-            if not args.f:
-                error(f'rm: cannot remove {repr(path)}: No such file or directory')
-            return
-        if os.path.isdir(path) and not args.r:
-            error(f'rm: cannot remove directory {repr(path)} without -r')
-            return
-        if os.path.isdir(path):
-            shutil.rmtree(path)
-        else:
-            os.remove(path)
+        for path in args.paths:
+            if not os.path.lexists(path):
+                if not args.f:
+                    error(f'rm: cannot remove {repr(path)}: No such file or directory')
+                continue
+            if os.path.isdir(path) and not os.path.islink(path):
+                if not args.r:
+                    error(f'rm: cannot remove directory {repr(path)} without -r')
+                    continue
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
 
 class pwd(Command):
     def __init__(self) -> None:
@@ -259,57 +791,531 @@ class du(FallbackCommand):
     def __init__(self):
         self.parser = argparse.ArgumentParser(prog='du', add_help=False)
         self.parser.add_argument('-h', action='store_true', help='print sizes in human readable format (e.g., 1K 234M 2G)')
-        self.parser.add_argument('path', nargs='?', default='.')
+        self.parser.add_argument('paths', nargs='*', default=['.'])
 
     @staticmethod
     def convert_bytes(size):
         return to_human_readable_size(size)
 
-    def _file(self, args, filepath) -> int:
-        size = os.path.getsize(filepath)
-        if args.h:
-            size_s = self.convert_bytes(size)
-        else:
-            size_s = size
-        print(str(size_s).ljust(8), filepath)
-        return size
-
-    def _dir(self, args, filepath) -> int:
+    @staticmethod
+    def _tree_size(path) -> int:
         size = 0
-        for root, dirs, files in os.walk(filepath):
+        for root, dirs, files in os.walk(path):
             for f in files:
                 size += os.path.getsize(os.path.join(root, f))
-        if args.h:
-            size_s = self.convert_bytes(size)
-        else:
-            size_s = size
-        print(str(size_s).ljust(8), filepath)
         return size
 
+    def _rows(self, paths):
+        """`(path, size)` for each entry of a directory then the directory, or for a file"""
+        for path in paths:
+            if not os.path.exists(path):
+                error(f'du: cannot access {repr(path)}: No such file or directory')
+                continue
+            if not os.path.isdir(path):
+                yield path, os.path.getsize(path)
+                continue
+            total = 0
+            for name in sorted(os.listdir(path)):
+                child = os.path.join(path, name)
+                size = self._tree_size(child) if os.path.isdir(child) else os.path.getsize(child)
+                total += size
+                yield child, size
+            yield path, total
+
+    def query(self, context, *args):
+        try:
+            args = self.parser.parse_args(args)
+        except SystemExit:
+            return None
+        return Table([('path', 's'), ('size', 'q')], self._rows(args.paths)).load()
+
     def __call__(self, context, *args):
         try:
             args = self.parser.parse_args(args)
         except SystemExit:
             return
-        path = args.path
-        if not os.path.exists(path):
-            error(f'du: cannot access {repr(path)}: No such file or directory')
-            return
-        if os.path.isdir(path):
-            size = 0
-            for name in sorted(os.listdir(path)):
-                if os.path.isdir(os.path.join(path, name)):
-                    size += self._dir(args, os.path.join(path, name))
-                else:
-                    size += self._file(args, os.path.join(path, name))
+        for path, size in self._rows(args.paths):
             if args.h:
                 size = self.convert_bytes(size)
             print(str(size).ljust(8), path)
-        else:
-            self._file(args, path)
         
 
+def _scan_dir(path: str, need_size: bool, skip_links: bool = False):
+    entries = []
+    try:
+        with os.scandir(path) as it:
+            for e in it:
+                if skip_links and e.is_symlink():
+                    continue
+                try:
+                    is_dir = e.is_dir(follow_symlinks=False)
+                except OSError:
+                    is_dir = False
+                size = None
+                if need_size and not is_dir:
+                    try:
+                        size = e.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        pass
+                entries.append((e.name, e.path, is_dir, size))
+    except OSError as e:
+        return entries, e
+    return entries, None
+
+def _walk_tree(prog: str, root: str, pool, ignore, need_size: bool = False, skip_links: bool = False):
+    """yield `(path, is_dir, size)` below `root` in pre-order
+
+    subdirectories are scanned ahead of time on `pool`, entries matching `ignore` are pruned,
+    and symbolic links too if `skip_links` is True
+    """
+    def visit(future, rel_dir):
+        entries, err = future.result()
+        if err is not None:
+            error(f'{prog}: {err.filename}: {err.strerror}')
+        kept = []
+        for name, path, is_dir, size in entries:
+            rel = rel_dir + name
+            if ignore is not None and ignore.ignored(rel, is_dir):
+                continue
+            fut = pool.submit(_scan_dir, path, need_size, skip_links) if is_dir else None
+            kept.append((path, is_dir, size, rel, fut))
+        for path, is_dir, size, rel, fut in kept:
+            yield path, is_dir, size
+            if fut is not None:
+                yield from visit(fut, rel + '/')
+    yield from visit(pool.submit(_scan_dir, root, need_size, skip_links), '')
+
+def _ordered(pool, fn, items, window: int):
+    """like `pool.map`, but consumes `items` lazily and yields results as soon as they are in order"""
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        while pending and (len(pending) > window or pending[0].done()):
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def _ignore_rules(root: str, excludes, no_ignore: bool):
+    from ..expand import IgnoreRules
+    rules = IgnoreRules()
+    if not no_ignore:
+        rules.add('.git/')
+        rules.rules.extend(IgnoreRules.from_file(os.path.join(root, '.gitignore')).rules)
+    for pattern in excludes:
+        rules.add(pattern)
+    return rules if rules else None
+
+class grep(FallbackCommand):
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(prog='grep')
+        self.parser.add_argument('pattern')
+        self.parser.add_argument('paths', nargs='*')
+        self.parser.add_argument('-r', action='store_true', help='search directories recursively')
+        self.parser.add_argument('-i', action='store_true', help='ignore case')
+        self.parser.add_argument('-l', action='store_true', help='only print names of files with matches')
+        self.parser.add_argument('-c', action='store_true', help='only print a count of matching lines per file')
+        self.parser.add_argument('-n', action='store_true', help='print line numbers')
+        self.parser.add_argument('-j', type=int, default=os.cpu_count() or 4, help='number of threads')
+        self.parser.add_argument('--exclude', action='append', default=[], help='skip paths matching this .gitignore-style pattern')
+        self.parser.add_argument('--no-ignore', action='store_true', help='do not read .gitignore or skip .git')
+
+    @staticmethod
+    def _search(path: str, regex, args, show_name: bool):
+        """return the output lines for one file, or an error message"""
+        prefix = f'{fmt.blue(path)}:' if show_name else ''
+        try:
+            f = open(path, 'rb')
+        except OSError as e:
+            return [], f'grep: {path}: {e.strerror}'
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return ([f'{prefix}0'] if args.c else []), None
+            try:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as e:
+                return [], f'grep: {path}: {e}'
+        with mm:
+            binary = mm.find(b'\0', 0, 8192) != -1
+            out = []
+            count = 0
+            lineno = 1
+            counted = 0
+            pos = 0
+            while pos <= size:
+                m = regex.search(mm, pos)
+                if m is None:
+                    break
+                start = mm.rfind(b'\n', 0, m.start()) + 1
+                end = mm.find(b'\n', m.start())
+                if end == -1:
+                    end = size
+                # `\s` or `[^x]` can run into the next line, a match must fit in one line like in grep
+                if m.end() > end and regex.search(mm, start, end) is None:
+                    pos = end + 1
+                    continue
+                count += 1
+                if args.l or binary and not args.c:
+                    break
+                if not args.c:
+                    line = mm[start:end].decode('utf-8', 'replace')
+                    if args.n:
+                        lineno += mm[counted:start].count(b'\n')
+                        counted = start
+                        line = f'{fmt.gray(str(lineno))}:{line}'
+                    out.append(prefix + line)
+                pos = end + 1
+        if args.c:
+            return [f'{prefix}{count}'], None
+        if count == 0:
+            return [], None
+        if args.l:
+            return [path], None
+        if binary:
+            return [f'Binary file {path} matches'], None
+        return out, None
+
+    def __call__(self, context, *args):
+        try:
+            args = self.parser.parse_args(args)
+        except SystemExit:
+            return
+        flags = re.M | (re.I if args.i else 0)
+        try:
+            regex = re.compile(args.pattern.encode(), flags)
+        except re.error as e:
+            error(f'grep: invalid pattern: {e}')
+            return
+        paths = args.paths or (['.'] if args.r else [])
+        if not paths:
+            error('grep: no input files')
+            return
+        show_name = args.r or len(paths) > 1
+
+        with ThreadPoolExecutor(max(args.j, 1)) as pool:
+            def files():
+                for path in paths:
+                    if os.path.isdir(path):
+                        if not args.r:
+                            error(f'grep: {path}: Is a directory')
+                            continue
+                        ignore = _ignore_rules(path, args.exclude, args.no_ignore)
+                        # like `grep -r`, links met while walking are not followed, named ones are
+                        for p, is_dir, _ in _walk_tree('grep', path, pool, ignore, skip_links=True):
+                            if not is_dir:
+                                yield p
+                    elif os.path.exists(path):
+                        yield path
+                    else:
+                        error(f'grep: {path}: No such file or directory')
+
+            search = lambda path: self._search(path, regex, args, show_name)
+            for lines, err in _ordered(pool, search, files(), window=args.j * 4):
+                if err is not None:
+                    error(err)
+                if lines:
+                    print('\n'.join(lines), flush=True)
+
+class find(FallbackCommand):
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(prog='find')
+        self.parser.add_argument('paths', nargs='*', default=['.'])
+        self.parser.add_argument('-name', help='base name matches this glob pattern')
+        self.parser.add_argument('-type', choices=['f', 'd'], help='f for files, d for directories')
+        self.parser.add_argument('-size', help='[+-]N[ckMG], more than, less than or exactly N units (default 512-byte blocks)')
+        self.parser.add_argument('-j', type=int, default=os.cpu_count() or 4, help='number of threads')
+        self.parser.add_argument('--exclude', action='append', default=[], help='skip paths matching this .gitignore-style pattern')
+        self.parser.add_argument('--no-ignore', action='store_true', help='do not read .gitignore or skip .git')
+
+    @staticmethod
+    def _size_test(spec: str):
+        m = re.match(r'^([+-]?)(\d+)([cwbkMG]?)$', spec)
+        if m is None:
+            return None
+        sign, n, unit = m.group(1), int(m.group(2)), m.group(3) or 'b'
+        unit = {'c': 1, 'w': 2, 'b': 512, 'k': 1024, 'M': 1024**2, 'G': 1024**3}[unit]
+        def test(size):
+            units = -(-size // unit)    # rounded up, like find
+            if sign == '+':
+                return units > n
+            if sign == '-':
+                return units < n
+            return units == n
+        return test
+
+    def __call__(self, context, *args):
+        # `-size -1k` would be taken as an option by argparse
+        args = list(args)
+        if '-size' in args[:-1]:
+            i = args.index('-size')
+            args[i:i+2] = [f'-size={args[i+1]}']
+        try:
+            args = self.parser.parse_args(args)
+        except SystemExit:
+            return
+        from ..expand import translate
+        name = translate(args.name) if args.name else None
+        size_test = None
+        if args.size is not None:
+            size_test = self._size_test(args.size)
+            if size_test is None:
+                error(f'find: invalid argument {repr(args.size)} to -size')
+                return
+
+        def match(path, is_dir, size):
+            if args.type == 'f' and is_dir or args.type == 'd' and not is_dir:
+                return False
+            if name is not None and name.match(os.path.basename(path)) is None:
+                return False
+            if size_test is not None:
+                if is_dir or size is None or not size_test(size):
+                    return False
+            return True
+
+        with ThreadPoolExecutor(max(args.j, 1)) as pool:
+            for root in args.paths:
+                if not os.path.exists(root):
+                    error(f'find: {repr(root)}: No such file or directory')
+                    continue
+                is_dir = os.path.isdir(root)
+                size = None if is_dir else os.path.getsize(root)
+                if match(root, is_dir, size):
+                    print(root)
+                if not is_dir:
+                    continue
+                ignore = _ignore_rules(root, args.exclude, args.no_ignore)
+                batch = []
+                flushed = time.monotonic()
+                for path, is_dir, size in _walk_tree('find', root, pool, ignore, need_size=size_test is not None):
+                    if match(path, is_dir, size):
+                        batch.append(path)
+                    # a directory is scanned next, which may be slow, so nothing waits behind it
+                    if batch and (is_dir or len(batch) >= 256 or time.monotonic() - flushed >= 0.05):
+                        print('\n'.join(batch), flush=True)
+                        batch.clear()
+                        flushed = time.monotonic()
+                if batch:
+                    print('\n'.join(batch), flush=True)
+
+# hex digest length -> algorithm, to read manifests written without -a
+_hex_lengths = {32: 'md5', 40: 'sha1', 64: 'sha256', 128: 'blake2b'}
+_bsd_tags = {'MD5': 'md5', 'SHA1': 'sha1', 'SHA256': 'sha256', 'BLAKE2b': 'blake2b', 'BLAKE2B': 'blake2b'}
+_gnu_line = re.compile(r'^(\\?)([0-9a-fA-F]+) [ *](.*)$')
+_bsd_line = re.compile(r'^(\\?)(\w+) \((.*)\) = ([0-9a-fA-F]+)$')
+_HASH_CHUNK = 16 * 1024 * 1024
+
+def _default_hash_cache() -> str:
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(root, 'ctsh', 'hashsum.json')
+
+class _DigestCache:
+    """digests keyed by `(path, size, mtime_ns, inode)`, stored as json"""
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == 1:
+                self.entries = data['entries']
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    def get(self, algorithm: str, path: str, st):
+        entry = self.entries.get(f'{algorithm}:{path}')
+        if entry is not None and entry[:3] == [st.st_size, st.st_mtime_ns, st.st_ino]:
+            return entry[3]
+        return None
+
+    def put(self, algorithm: str, path: str, st, digest: str):
+        with self.lock:
+            self.entries[f'{algorithm}:{path}'] = [st.st_size, st.st_mtime_ns, st.st_ino, digest]
+            self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'wt', encoding='utf-8') as f:
+            json.dump({'version': 1, 'entries': self.entries}, f)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+def _hash_file(path: str, algorithm: str, cache, stop):
+    """return `(hexdigest, error message)`, both are None if stopped"""
+    if stop.is_set():
+        return None, None
+    try:
+        f = open(path, 'rb')
+    except OSError as e:
+        return None, f'hashsum: {path}: {e.strerror}'
+    with f:
+        st = os.fstat(f.fileno())
+        key = os.path.abspath(path)
+        if cache is not None:
+            digest = cache.get(algorithm, key, st)
+            if digest is not None:
+                return digest, None
+        h = hashlib.new(algorithm)
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if st.st_size > 0 else None
+        except (OSError, ValueError):
+            # pipes, devices and some network filesystems
+            mm = None
+        try:
+            if mm is not None:
+                # large updates release the GIL, so other files are hashed meanwhile
+                with mm, memoryview(mm) as view:
+                    for i in range(0, len(view), _HASH_CHUNK):
+                        if stop.is_set():
+                            return None, None
+                        h.update(view[i:i+_HASH_CHUNK])
+            else:
+                while True:
+                    data = f.read(_HASH_CHUNK)
+                    if not data:
+                        break
+                    if stop.is_set():
+                        return None, None
+                    h.update(data)
+        except OSError as e:
+            return None, f'hashsum: {path}: {e.strerror}'
+        digest = h.hexdigest()
+        if cache is not None:
+            after = os.fstat(f.fileno())
+            # a write within the timestamp granularity would not change the mtime, don't trust fresh files
+            settled = time.time_ns() - after.st_mtime_ns > 2 * 10**9
+            if settled and (after.st_size, after.st_mtime_ns) == (st.st_size, st.st_mtime_ns):
+                cache.put(algorithm, key, st, digest)
+        return digest, None
+
+class hashsum(Command):
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(prog='hashsum')
+        self.parser.add_argument('paths', nargs='*')
+        self.parser.add_argument('-a', '--algorithm', choices=['sha256', 'md5', 'blake2b', 'sha1'], help='default sha256, or guessed from the manifest with -c')
+        self.parser.add_argument('-r', action='store_true', help='hash files in directories recursively')
+        self.parser.add_argument('-c', '--check', action='store_true', help='read checksums from the given manifest files and verify them')
+        self.parser.add_argument('-q', '--quiet', action='store_true', help='with -c, only print failures')
+        self.parser.add_argument('--cache', nargs='?', const=_default_hash_cache(), help=f'reuse digests of unchanged files, stored in this json file (default {_default_hash_cache()})')
+        self.parser.add_argument('-j', type=int, default=os.cpu_count() or 4, help='number of threads')
+
+    def _files(self, paths, recursive: bool, pool):
+        for path in paths:
+            if os.path.isdir(path):
+                if not recursive:
+                    error(f'hashsum: {path}: Is a directory')
+                    continue
+                for p, is_dir, _ in _walk_tree('hashsum', path, pool, None):
+                    if not is_dir:
+                        yield p
+            else:
+                yield path
+
+    @staticmethod
+    def _read_manifest(path: str, algorithm):
+        """yield `(algorithm, digest, path)`, or None for a malformed line"""
+        with open(path, 'rt', encoding='utf-8', errors='surrogateescape') as f:
+            for line in f:
+                line = line.rstrip('\r\n')
+                if not line or line.startswith('#'):
+                    continue
+                m = _bsd_line.match(line)
+                if m is not None:
+                    escaped, tag, name, digest = m.groups()
+                    algo = algorithm or _bsd_tags.get(tag)
+                else:
+                    m = _gnu_line.match(line)
+                    if m is None:
+                        yield None
+                        continue
+                    escaped, digest, name = m.groups()
+                    algo = algorithm or _hex_lengths.get(len(digest))
+                if algo is None:
+                    yield None
+                    continue
+                if escaped:
+                    name = re.sub(r'\\(.)', lambda m: '\n' if m.group(1) == 'n' else m.group(1), name)
+                yield algo, digest.lower(), name
+
+    def __call__(self, context, *args):
+        try:
+            args = self.parser.parse_args(args)
+        except SystemExit:
+            return
+        if not args.paths:
+            error('hashsum: no input files')
+            return
+        cache = _DigestCache(args.cache) if args.cache else None
+        stop = threading.Event()
+        try:
+            with ThreadPoolExecutor(max(args.j, 1)) as pool:
+                try:
+                    if args.check:
+                        self._check(args, cache, stop, pool)
+                    else:
+                        algorithm = args.algorithm or 'sha256'
+                        work = lambda path: (path, *_hash_file(path, algorithm, cache, stop))
+                        for path, digest, err in _ordered(pool, work, self._files(args.paths, args.r, pool), window=args.j * 4):
+                            if err is not None:
+                                error(err)
+                            elif digest is not None:
+                                print(f'{digest}  {path}')
+                except BaseException:
+                    # let the workers drop what they are doing
+                    stop.set()
+                    raise
+        finally:
+            if cache is not None:
+                try:
+                    cache.save()
+                except OSError as e:
+                    error(f'hashsum: cannot write cache {args.cache}: {e.strerror}')
+
+    def _check(self, args, cache, stop, pool):
+        def entries():
+            for manifest in args.paths:
+                try:
+                    yield from self._read_manifest(manifest, args.algorithm)
+                except OSError as e:
+                    error(f'hashsum: {manifest}: {e.strerror}')
+
+        def work(entry):
+            if entry is None:
+                return None, None, None
+            algo, expected, path = entry
+            digest, err = _hash_file(path, algo, cache, stop)
+            return entry, digest, err
+
+        failed = unreadable = malformed = 0
+        for entry, digest, err in _ordered(pool, work, entries(), window=args.j * 4):
+            if entry is None:
+                malformed += 1
+                continue
+            _, expected, path = entry
+            if err is not None:
+                unreadable += 1
+                error(err)
+                print(f'{path}: FAILED open or read')
+            elif digest != expected:
+                failed += 1
+                error(f'{path}: FAILED')
+            elif not args.quiet:
+                print(f'{path}: OK')
+        if malformed:
+            error(f'hashsum: WARNING: {malformed} line{"s" if malformed > 1 else ""} improperly formatted')
+        if unreadable:
+            error(f'hashsum: WARNING: {unreadable} listed file{"s" if unreadable > 1 else ""} could not be read')
+        if failed:
+            error(f'hashsum: WARNING: {failed} computed checksum{"s" if failed > 1 else ""} did NOT match')
+
 class conda(Command):
+    # the line goes to `os.system`, `"numpy>=1.20"` must stay quoted
+    expand_globs = False
+
     def __init__(self) -> None:
         pass
 
@@ -339,6 +1345,9 @@ class conda(Command):
 from ast import literal_eval
 
 class export(Command):
+    # `FOO={a,b}` is a value, not two words
+    expand_globs = False
+
     def __call__(self, context, *args):
         flag = False
         for a in args:
@@ -358,7 +1367,211 @@ class export(Command):
         if not flag:
             name = type(self).__name__.lstrip('_')
             error(f'{name}: invalid arguments')
+        context.invalidate()
 
 class _set(export):
     pass
 
+
+class timeout(Command):
+    expand_args = False
+
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(prog='timeout')
+        self.parser.add_argument('duration', type=float, help='seconds')
+        self.parser.add_argument('line', nargs=argparse.REMAINDER)
+
+    def accepts(self, args) -> bool:
+        # `timeout -s KILL 1 cmd` or `timeout 5s cmd` are for GNU timeout
+        if not args:
+            return True
+        try:
+            float(args[0])
+        except ValueError:
+            return False
+        return True
+
+    def __call__(self, context, *args):
+        try:
+            args = self.parser.parse_args(args)
+        except SystemExit:
+            return
+        from ..parser import parse, Block
+        from ..interrupt import time_limit, CommandTimeout
+        line = ' '.join(args.line)
+        obj = parse(line, context)
+        if isinstance(obj, Block):
+            error('timeout: multiline blocks are not supported')
+            return
+        try:
+            with time_limit(args.duration):
+                obj(context)
+        except CommandTimeout:
+            error(f'timeout: {repr(line)} timed out after {args.duration:g}s')
+
+class watch(Command):
+    expand_args = False
+
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(prog='watch', usage='watch [options] paths... -- line')
+        self.parser.add_argument('paths', nargs='+')
+        self.parser.add_argument('-d', '--debounce', type=float, default=100, help='milliseconds without changes before rerunning (default 100)')
+        self.parser.add_argument('--poll', action='store_true', help='poll for changes instead of using inotify')
+        self.parser.add_argument('--interval', type=float, default=1, help='seconds between polls (default 1)')
+        self.parser.add_argument('--exclude', action='append', default=[], help='ignore paths matching this .gitignore-style pattern')
+        self.parser.add_argument('--no-ignore', action='store_true', help='do not read .gitignore or skip .git')
+
+    def accepts(self, args) -> bool:
+        # `watch -n 1 nvidia-smi` is procps watch
+        return '--' in args
+
+    def __call__(self, context, *args):
+        if '--' not in args:
+            error('watch: usage: watch [options] paths... -- line')
+            return
+        i = args.index('--')
+        try:
+            opts = self.parser.parse_args(args[:i])
+        except SystemExit:
+            return
+        line = ' '.join(args[i+1:])
+        if not line.strip():
+            error('watch: nothing to run')
+            return
+        import traceback
+        from ..parser import parse, replace_vars, Block
+        from ..expand import expand_args
+        from ..interrupt import interrupt_main, RunCancelled
+        from ..watcher import Root, InotifyWatcher, open_watcher, WatchThread
+        if isinstance(parse(line, context), Block):
+            error('watch: multiline blocks are not supported')
+            return
+
+        # files a python run writes itself would restart it forever
+        excludes = opts.exclude if opts.no_ignore else ['__pycache__/', '*.pyc', '.pytest_cache/'] + opts.exclude
+        roots = []
+        for path in expand_args([replace_vars(p, context) for p in opts.paths]):
+            if not os.path.exists(path):
+                error(f'watch: {path}: No such file or directory')
+                return
+            ignore = _ignore_rules(path, excludes, opts.no_ignore) if os.path.isdir(path) else None
+            roots.append(Root(path, ignore))
+        watcher = open_watcher(roots, poll=opts.poll, interval=opts.interval)
+
+        lock = threading.Lock()
+        changed = threading.Event()
+        state = {'running': False, 'cancelled': False, 'paths': []}
+
+        def on_change(paths):
+            with lock:
+                state['paths'].extend(paths)
+                changed.set()
+                # stop the run in progress, it is working on stale files
+                if state['running'] and not state['cancelled']:
+                    state['cancelled'] = True
+                    interrupt_main()
+
+        def on_sigint(signum, frame):
+            # a cancelled run stops quietly, Ctrl-C stops the watch
+            if state['cancelled']:
+                raise RunCancelled
+            raise KeyboardInterrupt
+
+        old_handler = signal.signal(signal.SIGINT, on_sigint)
+        thread = WatchThread(watcher, opts.debounce / 1000, on_change)
+        thread.start()
+        kind = 'inotify' if isinstance(watcher, InotifyWatcher) else 'polling'
+        print(fmt.gray(f'[watch] {kind}, press Ctrl-C to stop'))
+        try:
+            while True:
+                try:
+                    with lock:
+                        changed.clear()
+                        state['running'] = True
+                        state['cancelled'] = False
+                    try:
+                        parse(line, context)(context)
+                    except (SystemExit, KeyboardInterrupt, RunCancelled):
+                        raise
+                    except:
+                        error(traceback.format_exc(), end='')
+                    finally:
+                        with lock:
+                            state['running'] = False
+                    if not state['cancelled']:
+                        print(fmt.gray('[watch] waiting for changes'), flush=True)
+                    while not changed.wait(0.5):
+                        pass
+                except RunCancelled:
+                    # a cancel may land just after the run finished
+                    pass
+                with lock:
+                    paths, state['paths'] = state['paths'], []
+                shown = ', '.join(os.path.relpath(p) for p in paths[:3])
+                more = f' and {len(paths) - 3} more' if len(paths) > 3 else ''
+                restart = 'restarting' if state['cancelled'] else 'changed'
+                print(fmt.gray(f'[watch] {restart}: {shown}{more}'), flush=True)
+        except KeyboardInterrupt:
+            print()
+        finally:
+            thread.stop()
+            signal.signal(signal.SIGINT, old_handler)
+
+class watchdog(Command):
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(prog='watchdog')
+        self.parser.add_argument('seconds', nargs='?', help="dump the python stack of commands running longer than this, or 'off'")
+
+    def __call__(self, context, *args):
+        try:
+            args = self.parser.parse_args(args)
+        except SystemExit:
+            return
+        if args.seconds is None:
+            print('off' if context.watchdog is None else f'{context.watchdog:g}s')
+        elif args.seconds == 'off':
+            context.watchdog = None
+        else:
+            try:
+                context.watchdog = float(args.seconds)
+            except ValueError:
+                error(f'watchdog: invalid duration: {repr(args.seconds)}')
+
+class profile(Command):
+    expand_args = False
+
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(prog='profile')
+        self.parser.add_argument('-m', action='store_true', help='profile memory allocations with tracemalloc')
+        self.parser.add_argument('-s', action='store_true', help='sample the stack from a background thread')
+        self.parser.add_argument('-n', type=int, default=20, help='number of entries to show')
+        self.parser.add_argument('-i', type=float, default=5, help='sampling interval in milliseconds')
+        self.parser.add_argument('-o', help='save cProfile stats to this file')
+        self.parser.add_argument('line', nargs=argparse.REMAINDER)
+
+    def __call__(self, context, *args):
+        try:
+            args = self.parser.parse_args(args)
+        except SystemExit:
+            return
+        from ..parser import parse, Block
+        from .. import profiling
+        line = ' '.join(args.line)
+        obj = parse(line, context)
+        if isinstance(obj, Block):
+            error('profile: multiline blocks are not supported')
+            return
+        fn = lambda: obj(context)
+        if args.m:
+            profiling.profile_memory(fn, top=args.n)
+        elif args.s:
+            profiling.profile_sampling(fn, top=args.n, interval=args.i / 1000)
+        else:
+            profiling.profile_cpu(fn, top=args.n, output=args.o)
+
+class detach(Command):
+    def __call__(self, context, *args):
+        if context.session is None:
+            error('detach: not attached to a ctsh daemon, start one with `ctsh attach`')
+            return
+        context.session.detach()
@@ -1,4 +1,6 @@
 from .commands.base import Command, FallbackCommand
+from .display import Display
+from collections import ChainMap
 import builtins
 import os
 
@@ -10,6 +12,17 @@ class Context:
         self.history = []
         self.commands = {}
         self.fallback_commands = {}
+        self.display = Display()
+        # dump the python stack of commands running longer than this (seconds)
+        self.watchdog = None
+        # set when running inside `ctsh daemon`, see daemon.Session
+        self.session = None
+        # variables are resolved in this order
+        self.scopes = ChainMap(self.g, builtins.__dict__, os.environ)
+        # lookup cache for the layers below `g`, dropped when `version` changes
+        self.version = 0
+        self._cache = {}
+        self._cache_version = 0
 
     def register_command(self, cmd: Command):
         assert isinstance(cmd, Command)
@@ -19,6 +32,10 @@ class Context:
         else:
             self.commands[name] = cmd
 
+    def invalidate(self):
+        """call this after builtins or environment variables may have changed"""
+        self.version += 1
+
     def __getitem__(self, key: str):
         val = self.get(key)
         if val is Context.DoesNotExist:
@@ -29,10 +46,19 @@ class Context:
         self.g[key] = val
 
     def get(self, key: str):
+        # `g` is mutated by `exec` behind our back, so it is always probed directly
         val = self.g.get(key, Context.DoesNotExist)
         if val is not Context.DoesNotExist: return val
-        val = builtins.__dict__.get(key, Context.DoesNotExist)
-        if val is not Context.DoesNotExist: return val
-        val = os.environ.get(key, Context.DoesNotExist)
-        if val is not Context.DoesNotExist: return val
-        return Context.DoesNotExist
\ No newline at end of file
+        if self._cache_version != self.version:
+            self._cache.clear()
+            self._cache_version = self.version
+        val = self._cache.get(key, _miss)
+        if val is not _miss: return val
+        val = Context.DoesNotExist
+        for scope in self.scopes.maps[1:]:
+            val = scope.get(key, Context.DoesNotExist)
+            if val is not Context.DoesNotExist: break
+        self._cache[key] = val
+        return val
+
+_miss = object()
@@ -0,0 +1,587 @@
+"""warm sessions behind a unix domain socket
+
+`ctsh daemon` imports the modules to preload once, then forks a shell session for every
+`ctsh attach <name>`, so a new session starts in milliseconds with the preloaded modules
+already in its namespace. Like tmux, every session runs on its own pty: the daemon holds the
+master side and the client relays bytes between it and the real terminal, so Ctrl-C, Ctrl-Z
+and job control behave as in a local shell. `detach` leaves the session running, and
+attaching to the same name resumes it.
+"""
+import importlib
+import json
+import os
+import pty
+import select
+import signal
+import socket
+import stat
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+def _default_dir() -> str:
+    root = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(root, f'ctsh-{os.getuid()}')
+
+def socket_path() -> str:
+    path = os.environ.get('CTSH_SOCKET')
+    if path:
+        return path
+    return os.path.join(_default_dir(), 'daemon.sock')
+
+def _private_dir(path: str, create: bool):
+    """make sure `path` is a directory only we can use, the socket hands out terminals"""
+    if create:
+        try:
+            os.mkdir(path, 0o700)
+        except FileExistsError:
+            pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise PermissionError(f'{path} must be a directory owned by uid {os.getuid()} with mode 0700')
+
+def _check_dir(path: str, create: bool):
+    # a custom `--socket` may live anywhere, the default directory is ours to check
+    directory = os.path.dirname(os.path.abspath(path))
+    if directory == os.path.abspath(_default_dir()):
+        _private_dir(directory, create)
+
+def _peer_uid(sock: socket.socket):
+    """the uid of the process on the other end, None where the platform cannot tell"""
+    if hasattr(socket, 'SO_PEERCRED'):
+        creds = struct.Struct('3i')
+        _, uid, _ = creds.unpack(sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, creds.size))
+        return uid
+    if sys.platform == 'darwin':
+        # LOCAL_PEERCRED fills a `struct xucred`, the uid follows the version
+        _, uid = struct.unpack_from('Ii', sock.getsockopt(0, 0x001, 76))
+        return uid
+    return None
+
+def _trusted(sock: socket.socket) -> bool:
+    uid = _peer_uid(sock)
+    return uid is None or uid == os.getuid()
+
+class Channel:
+    """newline-delimited json messages over a unix socket"""
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.buffer = b''
+
+    def send(self, msg: dict):
+        self.sock.sendall(json.dumps(msg).encode() + b'\n')
+
+    def recv(self):
+        """return a message, or None when the peer has closed"""
+        while b'\n' not in self.buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                return None
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        return json.loads(line)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+class Frames:
+    """length-prefixed frames after the attach handshake
+
+    `d` carries terminal bytes, `r` a json window size and `e` a json event
+    """
+    header = struct.Struct('>cI')
+
+    def __init__(self, sock: socket.socket, buffer: bytes = b''):
+        self.sock = sock
+        self.buffer = buffer
+
+    def send(self, kind: bytes, payload: bytes):
+        self.sock.sendall(self.header.pack(kind, len(payload)) + payload)
+
+    def send_json(self, kind: bytes, msg):
+        self.send(kind, json.dumps(msg).encode())
+
+    def pop(self):
+        """the frames already buffered, as `(kind, payload)`"""
+        frames = []
+        while len(self.buffer) >= self.header.size:
+            kind, size = self.header.unpack_from(self.buffer)
+            end = self.header.size + size
+            if len(self.buffer) < end:
+                break
+            frames.append((kind, self.buffer[self.header.size:end]))
+            self.buffer = self.buffer[end:]
+        return frames
+
+    def recv(self):
+        """read once, return the complete frames, or None when the peer has closed"""
+        data = self.sock.recv(65536)
+        if not data:
+            return None
+        self.buffer += data
+        return self.pop()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+def _set_size(fd: int, size):
+    import fcntl, termios
+    if size:
+        rows, cols = size
+        fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack('HHHH', rows, cols, 0, 0))
+
+def _get_size(fd: int):
+    import fcntl, termios
+    try:
+        rows, cols, _, _ = struct.unpack('HHHH', fcntl.ioctl(fd, termios.TIOCGWINSZ, b'\0' * 8))
+    except OSError:
+        return None
+    return [rows, cols] if rows and cols else None
+
+# ---------------------------------------------------------------------------
+# daemon
+
+# output kept for the next attach while nobody is attached
+_BACKLOG = 64 * 1024
+
+class _SessionInfo:
+    def __init__(self, name: str, pid: int, ctrl: Channel, master: int):
+        self.name = name
+        self.pid = pid
+        self.ctrl = ctrl
+        self.master = master
+        self.client = None
+        # keystrokes not yet taken by the pty, and output nobody has seen
+        self.input = b''
+        self.backlog = bytearray()
+
+def serve(path: str, preload=()):
+    loaded = []
+    for name in preload:
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except Exception as e:
+            print(f'ctsh daemon: cannot preload {repr(name)}: {e}', file=sys.stderr)
+    preload = loaded
+    _check_dir(path, create=True)
+    if os.path.lexists(path):
+        if os.lstat(path).st_uid != os.getuid():
+            raise PermissionError(f'{path} belongs to another user')
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+    try:
+        server.bind(path)
+    finally:
+        os.umask(old_umask)
+    server.listen(16)
+    sessions = {}
+
+    def drop_client(s: _SessionInfo, event=None):
+        if s.client is None:
+            return
+        if event is not None:
+            try:
+                s.client.send_json(b'e', {'event': event})
+            except OSError:
+                pass
+        s.client.close()
+        s.client = None
+
+    def output(s: _SessionInfo, data: bytes):
+        if s.client is not None:
+            try:
+                s.client.send(b'd', data)
+                return
+            except OSError:
+                drop_client(s)
+        s.backlog += data
+        del s.backlog[:-_BACKLOG]
+
+    def close_session(s: _SessionInfo):
+        # what the session printed last, then the end
+        while s.master is not None:
+            try:
+                data = os.read(s.master, 65536)
+            except OSError:
+                data = b''
+            if not data:
+                break
+            output(s, data)
+        drop_client(s, 'exit')
+        s.ctrl.close()
+        if s.master is not None:
+            os.close(s.master)
+            s.master = None
+        try:
+            os.waitpid(s.pid, 0)
+        except ChildProcessError:
+            pass
+        sessions.pop(s.name, None)
+
+    try:
+        while True:
+            readers = [server]
+            writers = []
+            for s in sessions.values():
+                readers.append(s.ctrl)
+                if s.master is not None:
+                    readers.append(s.master)
+                    if s.input:
+                        writers.append(s.master)
+                if s.client is not None:
+                    readers.append(s.client)
+            ready, writable, _ = select.select(readers, writers, [])
+            for s in list(sessions.values()):
+                if s.master in writable:
+                    try:
+                        n = os.write(s.master, s.input)
+                    except BlockingIOError:
+                        n = 0
+                    except OSError:
+                        n = len(s.input)
+                    s.input = s.input[n:]
+            for r in ready:
+                if r is server:
+                    conn, _ = server.accept()
+                    if not _trusted(conn):
+                        conn.close()
+                        continue
+                    if _handle_client(Channel(conn), sessions, server, preload, output):
+                        return
+                    continue
+                s = next((s for s in sessions.values() if r in (s.ctrl, s.master, s.client)), None)
+                if s is None:
+                    continue
+                if r is s.master:
+                    try:
+                        data = os.read(s.master, 65536)
+                    except BlockingIOError:
+                        continue
+                    except OSError:
+                        # EIO, the session closed its side of the pty
+                        data = b''
+                    if data:
+                        output(s, data)
+                    else:
+                        os.close(s.master)
+                        s.master = None
+                elif r is s.client:
+                    try:
+                        frames = s.client.recv()
+                    except OSError:
+                        frames = None
+                    if frames is None:
+                        # the client went away without `detach`, the session keeps running
+                        drop_client(s)
+                        continue
+                    for kind, payload in frames:
+                        if kind == b'd':
+                            s.input += payload
+                        elif kind == b'r' and s.master is not None:
+                            _set_size(s.master, json.loads(payload))
+                else:
+                    msg = s.ctrl.recv()
+                    if msg is None:
+                        # the session exited
+                        close_session(s)
+                    elif msg.get('event') == 'detached':
+                        drop_client(s, 'detached')
+    finally:
+        for s in list(sessions.values()):
+            try:
+                os.kill(s.pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+            close_session(s)
+        server.close()
+        if os.path.exists(path):
+            os.remove(path)
+
+def _handle_client(conn: Channel, sessions: dict, server, preload, output) -> bool:
+    """handle one request, return True if the daemon should stop"""
+    msg = conn.recv()
+    if msg is None:
+        conn.close()
+        return False
+    op = msg.get('op')
+    if op == 'stop':
+        conn.send({'ok': True})
+        conn.close()
+        return True
+    if op == 'list':
+        conn.send({'sessions': {
+            name: {'pid': s.pid, 'attached': s.client is not None}
+            for name, s in sessions.items()
+        }})
+        conn.close()
+        return False
+    if op != 'attach':
+        conn.send({'error': 'bad request'})
+        conn.close()
+        return False
+
+    name = msg.get('session') or 'default'
+    s = sessions.get(name)
+    if s is not None:
+        if s.client is not None:
+            conn.send({'error': f'session {repr(name)} is already attached'})
+            conn.close()
+            return False
+        conn.send({'pid': s.pid, 'resumed': True})
+        s.client = Frames(conn.sock, conn.buffer)
+        if s.master is not None:
+            _set_size(s.master, msg.get('size'))
+        backlog = bytes(s.backlog)
+        s.backlog.clear()
+        if backlog:
+            output(s, backlog)
+        return False
+
+    master, slave = pty.openpty()
+    _set_size(slave, msg.get('size'))
+    parent_ctrl, child_ctrl = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            server.close()
+            parent_ctrl.close()
+            conn.close()
+            os.close(master)
+            for other in sessions.values():
+                other.ctrl.close()
+                if other.master is not None:
+                    os.close(other.master)
+                if other.client is not None:
+                    other.client.close()
+            code = _session_main(Channel(child_ctrl), slave, msg, preload)
+        finally:
+            os._exit(code)
+    child_ctrl.close()
+    os.close(slave)
+    os.set_blocking(master, False)
+    s = _SessionInfo(name, pid, Channel(parent_ctrl), master)
+    sessions[name] = s
+    conn.send({'pid': pid, 'resumed': False})
+    s.client = Frames(conn.sock, conn.buffer)
+    return False
+
+# ---------------------------------------------------------------------------
+# session, runs in a forked child of the daemon
+
+class Session:
+    def __init__(self, ctrl: Channel):
+        self.ctrl = ctrl
+
+    def detach(self):
+        """let go of the client, the session keeps running on its pty"""
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.ctrl.send({'event': 'detached'})
+
+def _session_main(ctrl: Channel, slave: int, msg: dict, preload) -> int:
+    import termios
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    # a session leader with the pty as its controlling terminal, as under a terminal emulator
+    os.setsid()
+    import fcntl
+    fcntl.ioctl(slave, termios.TIOCSCTTY, 0)
+    for fd in range(3):
+        os.dup2(slave, fd)
+    os.close(slave)
+    # the environment of the terminal that started the session, not of the daemon
+    env = msg.get('env')
+    if env:
+        os.environ.clear()
+        os.environ.update(env)
+    cwd = msg.get('cwd')
+    if cwd and os.path.isdir(cwd):
+        os.chdir(cwd)
+    from .main import CarrotShell
+    shell = CarrotShell()
+    shell.context.session = Session(ctrl)
+    for name in preload:
+        top = name.split('.')[0]
+        shell.context.g[top] = sys.modules[top]
+    try:
+        shell.run()
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        return 1
+    return 0
+
+# ---------------------------------------------------------------------------
+# client
+
+def _open(path: str) -> Channel:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except BaseException:
+        sock.close()
+        raise
+    if not _trusted(sock):
+        sock.close()
+        raise PermissionError(f'{path} is served by another user')
+    return Channel(sock)
+
+def _connect(path: str, start: bool, preload=()) -> Channel:
+    _check_dir(path, create=start)
+    try:
+        return _open(path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        if not start:
+            raise
+    cmd = [sys.executable, '-m', 'ctsh', 'daemon', '--socket', path]
+    if preload:
+        cmd += ['--preload', ','.join(preload)]
+    subprocess.Popen(
+        cmd, start_new_session=True,
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while True:
+        try:
+            return _open(path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.time() > deadline:
+                raise
+            time.sleep(0.02)
+
+def open_session(name: str, path: str, preload=(), size=None, start: bool = True):
+    """send the attach request, return `(reply, frames)`"""
+    conn = _connect(path, start=start, preload=preload)
+    conn.send({
+        'op': 'attach', 'session': name, 'cwd': os.getcwd(),
+        'env': dict(os.environ), 'size': size,
+    })
+    reply = conn.recv()
+    if reply is None or 'error' in reply:
+        conn.close()
+        return reply or {'error': 'daemon closed the connection'}, None
+    return reply, Frames(conn.sock, conn.buffer)
+
+def attach(name: str, path: str, preload=()) -> int:
+    import termios, tty
+    tty_fd = 0 if os.isatty(0) else None
+    size = _get_size(tty_fd) if tty_fd is not None else None
+    reply, frames = open_session(name, path, preload, size)
+    if frames is None:
+        print('ctsh: ' + reply['error'], file=sys.stderr)
+        return 1
+
+    # the window size follows the terminal, the handler only wakes up the loop
+    wake_r, wake_w = os.pipe()
+    os.set_blocking(wake_w, False)
+    def on_winch(signum, frame):
+        try:
+            os.write(wake_w, b'w')
+        except OSError:
+            pass
+    old_winch = signal.signal(signal.SIGWINCH, on_winch)
+
+    saved = termios.tcgetattr(tty_fd) if tty_fd is not None else None
+    event = None
+    try:
+        if saved is not None:
+            # every key, Ctrl-C and Ctrl-Z included, goes to the session's pty
+            tty.setraw(tty_fd)
+        readers = [frames, wake_r, 0]
+        while event is None:
+            ready, _, _ = select.select(readers, [], [])
+            if wake_r in ready:
+                os.read(wake_r, 64)
+                if tty_fd is not None:
+                    frames.send_json(b'r', _get_size(tty_fd))
+            if 0 in ready:
+                data = os.read(0, 65536)
+                if data:
+                    frames.send(b'd', data)
+                else:
+                    readers.remove(0)
+            if frames in ready:
+                got = frames.recv()
+                if got is None:
+                    event = 'closed'
+                    break
+                for kind, payload in got:
+                    if kind == b'd':
+                        os.write(1, payload)
+                    elif kind == b'e':
+                        event = json.loads(payload).get('event')
+    finally:
+        if saved is not None:
+            termios.tcsetattr(tty_fd, termios.TCSADRAIN, saved)
+        signal.signal(signal.SIGWINCH, old_winch)
+        os.close(wake_r)
+        os.close(wake_w)
+        frames.close()
+    if event == 'detached':
+        print(f'\r\n[detached from {name}]')
+    return 0
+
+def request(op: str, path: str):
+    conn = _connect(path, start=False)
+    try:
+        conn.send({'op': op})
+        return conn.recv()
+    finally:
+        conn.close()
+
+def cli(argv) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(prog='ctsh')
+    sub = parser.add_subparsers(dest='op', required=True)
+    p = sub.add_parser('daemon', help='run the session server in the foreground')
+    p.add_argument('--socket', default=socket_path())
+    p.add_argument('--preload', default=os.environ.get('CTSH_PRELOAD', ''), help='comma separated modules to import once')
+    p.add_argument('--stop', action='store_true', help='stop a running daemon and its sessions')
+    p = sub.add_parser('attach', help='attach this terminal to a session, starting the daemon if needed')
+    p.add_argument('session', nargs='?', default='default')
+    p.add_argument('--socket', default=socket_path())
+    p.add_argument('--preload', default=os.environ.get('CTSH_PRELOAD', ''))
+    p = sub.add_parser('sessions', help='list sessions')
+    p.add_argument('--socket', default=socket_path())
+    args = parser.parse_args(argv)
+
+    if sys.platform == 'win32' or not hasattr(socket, 'AF_UNIX'):
+        print('ctsh: daemon mode needs unix domain sockets', file=sys.stderr)
+        return 1
+    preload = [m.strip() for m in getattr(args, 'preload', '').split(',') if m.strip()]
+    try:
+        if args.op == 'daemon':
+            if args.stop:
+                request('stop', args.socket)
+                return 0
+            try:
+                serve(args.socket, preload)
+            except KeyboardInterrupt:
+                pass
+            return 0
+        if args.op == 'attach':
+            return attach(args.session, args.socket, preload)
+        reply = request('list', args.socket)
+        for name, info in (reply or {}).get('sessions', {}).items():
+            state = 'attached' if info['attached'] else 'detached'
+            print(f'{name}\tpid {info["pid"]}\t{state}')
+        return 0
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f'ctsh: no daemon listening on {args.socket}', file=sys.stderr)
+        return 1
+    except PermissionError as e:
+        print(f'ctsh: {e}', file=sys.stderr)
+        return 1
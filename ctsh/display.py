@@ -0,0 +1,177 @@
+import builtins
+import itertools
+import reprlib
+import shutil
+import sys
+from collections import Counter, OrderedDict, defaultdict, deque
+from .utils import getwch
+from . import fmt
+
+class Display(reprlib.Repr):
+    """bounded repr of values echoed by the shell
+
+    limits can be changed at runtime, e.g. `__context__.display.maxlist = 1000`
+    """
+    def __init__(self):
+        super().__init__()
+        self.maxtuple = 100
+        self.maxlist = 100
+        self.maxarray = 100
+        self.maxdict = 30
+        self.maxset = 100
+        self.maxfrozenset = 100
+        self.maxdeque = 100
+        self.maxstring = 500
+        self.maxlong = 1000
+        self.maxother = 500
+        self.maxbytes = 500
+        # raw `str` values are printed as-is up to this many characters
+        self.maxtext = 100000
+        self.pager = True
+
+    def repr_bytes(self, x, level):
+        if len(x) <= self.maxbytes:
+            return builtins.repr(x)
+        return builtins.repr(x[:self.maxbytes]) + f'...({len(x)} bytes)'
+
+    def repr_bytearray(self, x, level):
+        if len(x) <= self.maxbytes:
+            return builtins.repr(x)
+        return builtins.repr(x[:self.maxbytes]) + f'...({len(x)} bytes)'
+
+    def repr1(self, x, level):
+        # `reprlib` dispatches on the type name, so `Counter` or a subclass of `list` would get the
+        # full `repr` cut short afterwards, route them to the bounded container methods
+        typ = type(x)
+        if not hasattr(self, 'repr_' + typ.__name__):
+            for base, method in _containers:
+                if isinstance(x, base) and (typ in _known or typ.__repr__ is base.__repr__):
+                    return self._repr_subclass(x, level, base, method)
+        return super().repr1(x, level)
+
+    def _repr_subclass(self, x, level, base, method) -> str:
+        # the same shape as the builtin `repr`: `[1]` for a list subclass, `Name({1})` for a set one
+        name = type(x).__name__
+        if base is deque:
+            return self._repr_iterable(x, level, f'{name}([', '])', self.maxdeque)
+        if isinstance(x, defaultdict):
+            return f'{name}({builtins.repr(x.default_factory)}, {self.repr_dict(x, level)})'
+        if type(x) not in _known and base not in (set, frozenset):
+            return getattr(self, method)(x, level)
+        if not x:
+            return f'{name}()'
+        if base is set or base is frozenset:
+            return self._repr_iterable(x, level, f'{name}({{', '})', self.maxset)
+        return f'{name}({getattr(self, method)(x, level)})'
+
+    # `reprlib` sorts dicts and sets, which costs O(n log n) and hides the insertion order
+    def repr_dict(self, x, level):
+        if not x:
+            return '{}'
+        if level <= 0:
+            return '{...}'
+        repr1 = self.repr1
+        pieces = [
+            f'{repr1(k, level - 1)}: {repr1(v, level - 1)}'
+            for k, v in itertools.islice(x.items(), self.maxdict)
+        ]
+        if len(x) > self.maxdict:
+            pieces.append(getattr(self, 'fillvalue', '...'))
+        return '{' + ', '.join(pieces) + '}'
+
+    def repr_set(self, x, level):
+        if not x:
+            return 'set()'
+        return self._repr_iterable(x, level, '{', '}', self.maxset)
+
+    def repr_frozenset(self, x, level):
+        if not x:
+            return 'frozenset()'
+        return self._repr_iterable(x, level, 'frozenset({', '})', self.maxfrozenset)
+
+    def repr_int(self, x, level):
+        # `repr` of a huge int is quadratic, estimate the digits instead
+        if x.bit_length() > self.maxlong * 4:
+            return f'<int with {x.bit_length()} bits>'
+        return super().repr_int(x, level)
+
+    def format(self, val) -> str:
+        """text shown for a value, like `print(val)` but bounded"""
+        if isinstance(val, str):
+            if len(val) > self.maxtext:
+                return val[:self.maxtext] + fmt.gray(f'...({len(val)} characters)')
+            return val
+        if self._bounded(val):
+            return self.repr(val)
+        return str(val)
+
+    def _bounded(self, val) -> bool:
+        # containers and blobs whose `str` grows with their size
+        return hasattr(self, 'repr_' + type(val).__name__) or isinstance(val, tuple(base for base, _ in _containers))
+
+    def show(self, val):
+        """print a value, paging it if it does not fit on the screen"""
+        self._print(lambda: self.format(val))
+
+    def displayhook(self, val):
+        """a replacement for `sys.displayhook`"""
+        if val is None:
+            return
+        builtins._ = None
+        if self._bounded(val):
+            self._print(lambda: self.repr(val))
+        else:
+            self._print(lambda: builtins.repr(val))
+        builtins._ = val
+
+    def _print(self, render):
+        try:
+            text = render()
+            if self.pager and text and sys.stdout.isatty():
+                page(text)
+            else:
+                print(text)
+        except KeyboardInterrupt:
+            print()
+            print('KeyboardInterrupt')
+
+_containers = [
+    (dict, 'repr_dict'), (list, 'repr_list'), (tuple, 'repr_tuple'),
+    (set, 'repr_set'), (frozenset, 'repr_frozenset'), (deque, 'repr_deque'),
+]
+# subclasses whose own `repr` is `Name(<container>)`, others only when they keep the base `repr`
+_known = {Counter, OrderedDict, defaultdict}
+
+def _lines(text: str):
+    i = 0
+    n = len(text)
+    while i < n:
+        j = text.find('\n', i)
+        if j == -1:
+            j = n
+        yield text[i:j]
+        i = j + 1
+
+def page(text: str):
+    """a minimal `more`: space for the next page, enter for the next line, q to quit"""
+    size = shutil.get_terminal_size()
+    rows = max(size.lines - 1, 1)
+    lines = _lines(text)
+    pending = next(lines, None)
+    count = rows
+    while pending is not None:
+        chunk = []
+        while pending is not None and len(chunk) < count:
+            chunk.append(pending)
+            pending = next(lines, None)
+        sys.stdout.write('\n'.join(chunk) + '\n')
+        sys.stdout.flush()
+        if pending is None:
+            return
+        sys.stdout.write(fmt.gray('--More--'))
+        sys.stdout.flush()
+        c = getwch()
+        sys.stdout.write('\r\033[K')
+        if c in (3, ord('q'), ord('Q')):
+            return
+        count = 1 if c in (10, 13) else rows
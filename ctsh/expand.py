@@ -0,0 +1,278 @@
+import os
+import re
+import sys
+from functools import lru_cache
+from typing import List
+
+_magic = re.compile(r'[*?[]')
+_range = re.compile(r'^(-?\d+)\.\.(-?\d+)$|^([a-zA-Z])\.\.([a-zA-Z])$')
+
+def has_magic(s: str) -> bool:
+    return _magic.search(s) is not None
+
+def expand_braces(s: str) -> List[str]:
+    """`a{b,c}d` -> `abd acd`, `{1..3}` -> `1 2 3`"""
+    i = 0
+    while True:
+        start = s.find('{', i)
+        if start == -1:
+            return [s]
+        depth = 0
+        end = -1
+        commas = []
+        for j in range(start, len(s)):
+            c = s[j]
+            if c == '{':
+                depth += 1
+            elif c == '}':
+                depth -= 1
+                if depth == 0:
+                    end = j
+                    break
+            elif c == ',' and depth == 1:
+                commas.append(j)
+        if end == -1:
+            return [s]
+        body = s[start+1:end]
+        if commas:
+            bounds = [start] + commas + [end]
+            alts = [s[bounds[k]+1:bounds[k+1]] for k in range(len(bounds)-1)]
+        else:
+            alts = _expand_range(body)
+            if alts is None:
+                # `{}` or `{x}` is not an expansion
+                i = start + 1
+                continue
+        prefix, suffix = s[:start], s[end+1:]
+        out = []
+        for alt in alts:
+            out.extend(expand_braces(prefix + alt + suffix))
+        return out
+
+def _expand_range(body: str):
+    m = _range.match(body)
+    if m is None:
+        return None
+    if m.group(1) is not None:
+        a, b = int(m.group(1)), int(m.group(2))
+        step = 1 if a <= b else -1
+        return [str(x) for x in range(a, b + step, step)]
+    a, b = ord(m.group(3)), ord(m.group(4))
+    step = 1 if a <= b else -1
+    return [chr(x) for x in range(a, b + step, step)]
+
+@lru_cache(maxsize=1024)
+def translate(part: str):
+    """compile a single path component pattern, like `fnmatch.translate` but cached"""
+    flags = re.S | (re.I if sys.platform == 'win32' else 0)
+    return re.compile(_translate(part) + r'\Z', flags)
+
+def _translate(part: str) -> str:
+    res = []
+    i, n = 0, len(part)
+    while i < n:
+        c = part[i]
+        i += 1
+        if c == '*':
+            # collapse `**` inside a component
+            while i < n and part[i] == '*':
+                i += 1
+            res.append('[^/]*')
+        elif c == '?':
+            res.append('[^/]')
+        elif c == '[':
+            j = i
+            if j < n and part[j] in '!^':
+                j += 1
+            if j < n and part[j] == ']':
+                j += 1
+            while j < n and part[j] != ']':
+                j += 1
+            if j >= n:
+                res.append('\\[')
+            else:
+                body = part[i:j].replace('\\', '\\\\')
+                i = j + 1
+                if body[0] in '!^':
+                    body = '^' + body[1:]
+                res.append(f'[{body}]')
+        else:
+            res.append(re.escape(c))
+    return ''.join(res)
+
+def _scandir(path: str):
+    try:
+        with os.scandir(path or '.') as it:
+            yield from it
+    except OSError:
+        return
+
+def _join(base: str, name: str) -> str:
+    if not base:
+        return name
+    return os.path.join(base, name)
+
+def _is_dir(entry) -> bool:
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+def _walk_all(base: str):
+    for entry in _scandir(base):
+        if entry.name.startswith('.'):
+            continue
+        path = _join(base, entry.name)
+        yield path
+        try:
+            is_dir = entry.is_dir(follow_symlinks=False)
+        except OSError:
+            continue
+        if is_dir:
+            yield from _walk_all(path)
+
+def _walk(base: str, parts: List[str]):
+    if not parts:
+        yield base
+        return
+    part, rest = parts[0], parts[1:]
+    if part == '**' and not rest:
+        # like `glob.glob(recursive=True)`: the directory itself, then everything below it
+        if base:
+            yield os.path.join(base, '')
+        yield from _walk_all(base)
+        return
+    if part == '**':
+        # zero or more directories, every directory is scanned once
+        yield from _walk(base, rest)
+        for entry in _scandir(base):
+            if entry.name.startswith('.'):
+                continue
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir:
+                yield from _walk(_join(base, entry.name), parts)
+        return
+    if not has_magic(part):
+        path = _join(base, part)
+        if rest:
+            if os.path.isdir(path):
+                yield from _walk(path, rest)
+        elif os.path.lexists(path):
+            yield path
+        return
+    regex = translate(part)
+    hidden = part.startswith('.')
+    for entry in _scandir(base):
+        name = entry.name
+        if name.startswith('.') and not hidden:
+            continue
+        if regex.match(name) is None:
+            continue
+        if rest:
+            # prune: only directories can match the remaining components
+            if _is_dir(entry):
+                yield from _walk(_join(base, name), rest)
+        else:
+            yield _join(base, name)
+
+def iglob(pattern: str):
+    """yield paths matching `pattern`, which may contain `*`, `?`, `[...]` and `**`"""
+    seps = '/\\' if sys.platform == 'win32' else '/'
+    drive, rest = os.path.splitdrive(pattern)
+    base = drive
+    if rest[:1] and rest[0] in seps:
+        base += rest[0]
+    parts = [p for p in re.split(f'[{re.escape(seps)}]', rest) if p]
+    if rest.endswith(tuple(seps)) and parts:
+        # `dir/*/` only matches directories
+        for path in _walk(base, parts):
+            if os.path.isdir(path):
+                yield os.path.join(path, '')
+        return
+    yield from _walk(base, parts)
+
+def glob(pattern: str) -> List[str]:
+    paths = iglob(pattern)
+    if pattern.count('**') > 1:
+        paths = dict.fromkeys(paths)
+    return sorted(paths)
+
+def _quoted(s: str) -> bool:
+    return len(s) >= 2 and s[0] in '"\'' and s[-1] == s[0]
+
+def expand_args(args: List[str]) -> List[str]:
+    """brace and glob expansion of command arguments, like a posix shell
+
+    quoted arguments are passed through with the quotes removed,
+    and a pattern that matches nothing is kept as-is
+    """
+    out = []
+    for arg in args:
+        if _quoted(arg):
+            out.append(arg[1:-1])
+            continue
+        for word in expand_braces(arg):
+            if has_magic(word):
+                matches = glob(os.path.expanduser(word))
+                if matches:
+                    out.extend(matches)
+                    continue
+            out.append(word)
+    return out
+
+class IgnoreRules:
+    """`.gitignore`-style patterns, matched against `/`-separated paths relative to a root"""
+    def __init__(self, patterns=()):
+        self.rules = []
+        for pattern in patterns:
+            self.add(pattern)
+
+    @classmethod
+    def from_file(cls, path: str):
+        rules = cls()
+        try:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    rules.add(line)
+        except OSError:
+            pass
+        return rules
+
+    def add(self, pattern: str):
+        pattern = pattern.rstrip('\r\n').rstrip(' ')
+        if not pattern or pattern.startswith('#'):
+            return
+        negate = pattern.startswith('!')
+        if negate:
+            pattern = pattern[1:]
+        dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        # a slash at the beginning or in the middle anchors the pattern to the root
+        anchored = '/' in pattern
+        parts = pattern.lstrip('/').split('/')
+        res = []
+        for i, part in enumerate(parts):
+            last = i == len(parts) - 1
+            if part == '**':
+                res.append('.*' if last else '(?:[^/]*/)*')
+            else:
+                res.append(_translate(part) + ('' if last else '/'))
+        regex = ''.join(res)
+        if not anchored:
+            regex = '(?:.*/)?' + regex
+        self.rules.append((re.compile(regex + r'\Z', re.S), negate, dir_only))
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def ignored(self, rel: str, is_dir: bool) -> bool:
+        result = False
+        for regex, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel) is not None:
+                result = not negate
+        return result
@@ -11,6 +11,15 @@ def blue(s: str) -> str:
 def green(s: str) -> str:
     return rgb(0, 255, 0, s)
 
+def red(s: str) -> str:
+    return f'\033[91m{s}\033[0m'
+
+def yellow(s: str) -> str:
+    return rgb(230, 190, 90, s)
+
+def purple(s: str) -> str:
+    return rgb(200, 120, 230, s)
+
 def bold(s: str) -> str:
     return f'\033[1m{s}\033[0m'
 
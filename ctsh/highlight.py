@@ -0,0 +1,215 @@
+"""live highlighting of the input line
+
+Every token remembers the lexer mode after it and how far the lexer looked to produce it,
+so after an edit only the tokens that looked at the changed text are lexed again.
+"""
+import keyword
+import re
+from . import fmt
+from .context import Context
+from .utils import executables
+
+COMMAND = 'command'
+VARIABLE = 'variable'
+STRING = 'string'
+KEYWORD = 'keyword'
+UNKNOWN = 'unknown'
+
+STYLES = {
+    None: str,
+    COMMAND: fmt.green,
+    VARIABLE: fmt.blue,
+    STRING: fmt.yellow,
+    KEYWORD: fmt.purple,
+    UNKNOWN: fmt.red,
+}
+
+# lexer modes: the first word decides whether the rest is shell arguments or python
+HEAD, SHELL, PYTHON = range(3)
+
+_space = re.compile(r'\s+')
+_word = re.compile(r'\S+')
+_ident = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+_shell_plain = re.compile(r'''[^\s'"$]+''')
+_shell_var = re.compile(r'\$(?:\{[^}]*\}?|[A-Za-z_][A-Za-z0-9_]*)?')
+_shell_strings = {
+    '"': re.compile(r'"[^"]*"?'),
+    "'": re.compile(r"'[^']*'?"),
+}
+_py_prefix = re.compile(r'(?i:rb|br|fr|rf|[rbuf])?(?=[\'"])')
+# a backslash at the end of the text is part of the unclosed string
+_py_strings = {
+    '"""': re.compile(r'"""(?:[^\\]|\\.|\\\Z)*?(?:"""|\Z)', re.S),
+    "'''": re.compile(r"'''(?:[^\\]|\\.|\\\Z)*?(?:'''|\Z)", re.S),
+    '"': re.compile(r'"(?:[^"\\\n]|\\.|\\\Z)*"?'),
+    "'": re.compile(r"'(?:[^'\\\n]|\\.|\\\Z)*'?"),
+}
+_py_plain = re.compile(r'''[^\sA-Za-z_'"]+''')
+# an unknown first word followed by one of these is being defined
+_binding = '=,:'
+
+class Token:
+    __slots__ = ('start', 'end', 'kind', 'mode', 'reach')
+
+    def __init__(self, start: int, end: int, kind, mode: int, reach: int):
+        self.start = start
+        self.end = end
+        self.kind = kind
+        # the lexer mode after this token
+        self.mode = mode
+        # one past the last index looked at, the end of the text counts as an index
+        self.reach = reach
+
+class Highlighter:
+    def __init__(self, context: Context):
+        self.context = context
+        self.reset()
+
+    def reset(self):
+        self.text = ''
+        self.tokens = []
+        self.python = False
+
+    def update(self, text: str, python: bool = False) -> int:
+        """lex `text`, return the index from which its highlighting differs from the last text
+
+        `python` is set for continuation lines of a block, which have no command word
+        """
+        old_text, old_tokens = self.text, self.tokens
+        if python != self.python:
+            p = 0
+        elif text.startswith(old_text):
+            p = len(old_text)
+        elif old_text.startswith(text):
+            p = len(text)
+        else:
+            p = 0
+            for a, b in zip(old_text, text):
+                if a != b:
+                    break
+                p += 1
+        keep = len(old_tokens)
+        while keep and old_tokens[keep-1].reach > p:
+            keep -= 1
+        tokens = old_tokens[:keep]
+        if tokens:
+            pos, mode = tokens[-1].end, tokens[-1].mode
+        else:
+            pos, mode = 0, PYTHON if python else HEAD
+        self._lex(text, pos, mode, tokens)
+        self.text, self.tokens, self.python = text, tokens, python
+
+        # the first token that changed, within it the characters before both ends still agree
+        for old, new in zip(old_tokens[keep:], tokens[keep:]):
+            if old.start != new.start or old.kind != new.kind:
+                return min(p, new.start)
+            if old.end != new.end:
+                return min(p, old.end, new.end)
+        if len(tokens) > len(old_tokens):
+            return min(p, tokens[len(old_tokens)].start)
+        return p
+
+    def render(self, start: int = 0) -> str:
+        """the highlighted text from index `start`"""
+        tokens = self.tokens
+        i = len(tokens)
+        while i and tokens[i-1].end > start:
+            i -= 1
+        parts = []
+        for t in tokens[i:]:
+            s = self.text[max(t.start, start):t.end]
+            parts.append(STYLES[t.kind](s) if t.kind is not None else s)
+        return ''.join(parts)
+
+    def _lex(self, text: str, pos: int, mode: int, tokens: list):
+        n = len(text)
+        while pos < n:
+            m = _space.match(text, pos)
+            if m is not None:
+                tokens.append(Token(pos, m.end(), None, mode, m.end() + 1))
+                pos = m.end()
+                continue
+            if mode == HEAD:
+                pos, mode = self._lex_head(text, pos, tokens)
+            elif mode == SHELL:
+                pos = self._lex_shell(text, pos, tokens)
+            else:
+                pos = self._lex_python(text, pos, tokens)
+
+    def _lex_head(self, text: str, pos: int, tokens: list):
+        if text[pos] == '%' and 'profile' in self.context.commands:
+            tokens.append(Token(pos, pos + 1, COMMAND, HEAD, pos + 2))
+            return pos + 1, HEAD
+        m = _word.match(text, pos)
+        word = m.group()
+        if _ident.fullmatch(word) is None:
+            if word.startswith(('/', './', '../', '~')):
+                tokens.append(Token(pos, m.end(), COMMAND, SHELL, m.end() + 1))
+                return m.end(), SHELL
+            # `x=1`, `print(x)`, `[1, 2]`
+            return pos, PYTHON
+        # what follows decides between a single unit and a command line
+        s = _space.match(text, m.end())
+        after = s.end() if s is not None else m.end()
+        following = text[after:after+1]
+        kind, mode = self._classify(word, following)
+        tokens.append(Token(pos, m.end(), kind, mode, after + 1))
+        return m.end(), mode
+
+    def _classify(self, word: str, following: str):
+        """mirror `parse_single` and `parse_multi` without touching the filesystem"""
+        if keyword.iskeyword(word):
+            return KEYWORD, PYTHON
+        context = self.context
+        is_command = (
+            word in context.commands
+            or executables.known(word)
+            or word in context.fallback_commands
+        )
+        is_value = context.get(word) is not Context.DoesNotExist
+        if not following:
+            if is_value:
+                return VARIABLE, PYTHON
+            if is_command:
+                return COMMAND, SHELL
+            return UNKNOWN, PYTHON
+        if is_command:
+            return COMMAND, SHELL
+        if is_value:
+            return VARIABLE, PYTHON
+        if following in _binding:
+            return None, PYTHON
+        return UNKNOWN, PYTHON
+
+    def _lex_shell(self, text: str, pos: int, tokens: list) -> int:
+        c = text[pos]
+        if c in _shell_strings:
+            m = _shell_strings[c].match(text, pos)
+            kind = STRING
+        elif c == '$':
+            m = _shell_var.match(text, pos)
+            kind = VARIABLE
+        else:
+            m = _shell_plain.match(text, pos)
+            kind = None
+        tokens.append(Token(pos, m.end(), kind, SHELL, m.end() + 1))
+        return m.end()
+
+    def _lex_python(self, text: str, pos: int, tokens: list) -> int:
+        m = _py_prefix.match(text, pos)
+        if m is not None:
+            q = m.end()
+            quote = text[q:q+3]
+            if quote not in _py_strings:
+                quote = text[q]
+            m = _py_strings[quote].match(text, q)
+            tokens.append(Token(pos, m.end(), STRING, PYTHON, m.end() + 1))
+            return m.end()
+        m = _ident.match(text, pos)
+        if m is not None:
+            kind = KEYWORD if keyword.iskeyword(m.group()) else None
+        else:
+            m = _py_plain.match(text, pos)
+            kind = None
+        tokens.append(Token(pos, m.end(), kind, PYTHON, m.end() + 1))
+        return m.end()
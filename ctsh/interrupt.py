@@ -0,0 +1,153 @@
+import _thread
+import faulthandler
+import os
+import signal
+import subprocess
+import sys
+import threading
+from contextlib import contextmanager
+
+class CommandTimeout(Exception):
+    pass
+
+class RunCancelled(BaseException):
+    """stops a run that is no longer wanted, like KeyboardInterrupt but not reported"""
+
+@contextmanager
+def time_limit(seconds: float):
+    """raise `CommandTimeout` in the main thread if the body runs longer than `seconds`"""
+    if not seconds or seconds <= 0:
+        yield
+        return
+    if hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread():
+        def handler(signum, frame):
+            raise CommandTimeout(seconds)
+        old = signal.signal(signal.SIGALRM, handler)
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+        try:
+            yield
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, old)
+        return
+    # no SIGALRM on windows, interrupt the main thread from a timer instead
+    fired = []
+    def interrupt():
+        fired.append(True)
+        _thread.interrupt_main()
+    timer = threading.Timer(seconds, interrupt)
+    timer.start()
+    try:
+        yield
+    except KeyboardInterrupt:
+        if not fired:
+            raise
+    finally:
+        timer.cancel()
+    if fired:
+        raise CommandTimeout(seconds)
+
+@contextmanager
+def watchdog(seconds: float):
+    """dump the stack of every thread if the body runs longer than `seconds`"""
+    if not seconds or seconds <= 0:
+        yield
+        return
+    faulthandler.dump_traceback_later(seconds, repeat=False, file=sys.__stderr__)
+    try:
+        yield
+    finally:
+        faulthandler.cancel_dump_traceback_later()
+
+def interrupt_main():
+    """raise KeyboardInterrupt in the main thread, waking it up from a blocking call"""
+    if hasattr(signal, 'pthread_kill'):
+        signal.pthread_kill(threading.main_thread().ident, signal.SIGINT)
+    else:
+        _thread.interrupt_main()
+
+def _foreground_tty():
+    """the controlling terminal if this process owns it, else None"""
+    if sys.platform == 'win32':
+        return None
+    try:
+        fd = sys.stdin.fileno()
+        if os.isatty(fd) and os.tcgetpgrp(fd) == os.getpgrp():
+            return fd
+    except (OSError, ValueError):
+        pass
+    return None
+
+def _set_foreground(fd: int, pgrp: int):
+    # a background process calling tcsetpgrp gets SIGTTOU
+    old = signal.signal(signal.SIGTTOU, signal.SIG_IGN)
+    try:
+        os.tcsetpgrp(fd, pgrp)
+    finally:
+        signal.signal(signal.SIGTTOU, old)
+
+def run_shell(cmd: str) -> int:
+    """like `os.system`, but can be interrupted by a signal handler in the parent
+
+    When the shell owns a terminal, the child runs in its own process group which
+    becomes the foreground group, so Ctrl-C goes to the child only and a timeout
+    can stop the whole group.
+    """
+    fd = _foreground_tty()
+    if fd is None:
+        return _run_simple(cmd)
+    if sys.version_info >= (3, 11):
+        proc = subprocess.Popen(cmd, shell=True, process_group=0)
+    else:
+        proc = subprocess.Popen(cmd, shell=True, preexec_fn=os.setpgrp)
+    try:
+        _set_foreground(fd, proc.pid)
+        # it may have been stopped by reading the terminal before it was in the foreground
+        os.killpg(proc.pid, signal.SIGCONT)
+        while True:
+            _, status = os.waitpid(proc.pid, os.WUNTRACED)
+            if os.WIFSTOPPED(status):
+                # there is no job control, keep it running
+                os.killpg(proc.pid, signal.SIGCONT)
+                continue
+            break
+        if os.WIFSIGNALED(status):
+            proc.returncode = -os.WTERMSIG(status)
+        else:
+            proc.returncode = os.WEXITSTATUS(status)
+    except BaseException:
+        if proc.returncode is None:
+            _stop_group(proc)
+        raise
+    finally:
+        _set_foreground(fd, os.getpgrp())
+    if proc.returncode == -signal.SIGINT:
+        raise KeyboardInterrupt
+    return proc.returncode
+
+def _stop_group(proc: subprocess.Popen):
+    for sig in (signal.SIGINT, signal.SIGKILL):
+        try:
+            os.killpg(proc.pid, sig)
+        except ProcessLookupError:
+            break
+        try:
+            proc.wait(1)
+            return
+        except subprocess.TimeoutExpired:
+            pass
+
+def _run_simple(cmd: str) -> int:
+    proc = subprocess.Popen(cmd, shell=True)
+    try:
+        return proc.wait()
+    except BaseException:
+        # Ctrl-C reaches the child through the terminal, a timeout does not
+        if proc.poll() is None:
+            proc.terminate()
+            try:
+                proc.wait(1)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+        raise
@@ -1,7 +1,10 @@
-import os, sys
+import os, sys, re, shutil
 from .utils import *
 from .parser import *
 from . import commands, fmt
+from .prompt import Prompt, CondaSegment, CwdSegment, GitBranchSegment, GitDirtySegment
+from .interrupt import watchdog
+from .highlight import Highlighter
 from .version import __version__
 
 class CarrotShell(Shell):
@@ -24,6 +27,15 @@ class CarrotShell(Shell):
         self.curr_history_count = None
         self.curr_history_index = None
 
+        self.highlighter = Highlighter(self.context)
+
+        self.prompt_segments = Prompt([
+            CondaSegment(),
+            CwdSegment(),
+            GitBranchSegment(),
+            GitDirtySegment(),
+        ], on_update=self.repaint_prompt, is_idle=lambda: self.idle)
+
         # only display this on startup
         python_ver = f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}"
         python_info = f"(Python {python_ver} on {sys.platform})"
@@ -37,19 +49,7 @@ class CarrotShell(Shell):
             print(f'switch to {name} {python_info}')
 
     def get_prompt(self) -> str:
-        cwd = os.getcwd()
-        home_path = os.path.expanduser('~')
-
-        prefix = ''
-        conda_env = os.environ.get('CONDA_DEFAULT_ENV')
-        if conda_env is not None:
-            prefix += fmt.gray(f'({conda_env}) ')
-
-        if cwd.startswith(home_path):
-            cwd = '~' + cwd[len(home_path):]
-        cwd = fmt.gray(cwd)
-
-        prompt = f'{prefix}{cwd} 🥕 '
+        prompt = f'{self.prompt_segments.render()} 🥕 '
         if self.curr_block is not None:
             prompt = prompt[:-2] + '... '
         return prompt
@@ -69,9 +69,41 @@ class CarrotShell(Shell):
             self.curr_history_index = len(self.context.history) - 1
         # if index is valid, change buffer
         if 0 <= self.curr_history_index < len(self.context.history):
-            self.backspace_s(self.buffer)
-            self.buffer = self.context.history[self.curr_history_index]
-            self.write(self.buffer)
+            self.set_buffer(self.context.history[self.curr_history_index])
+
+    def redraw(self, old: str):
+        h = self.highlighter
+        if h.text != old:
+            # the line was reset, e.g. after Enter
+            h.reset()
+        start = h.update(self.buffer, python=self.curr_block is not None)
+        out = ''
+        if start < len(old):
+            out += self._move_back(old, start)
+        out += h.render(start)
+        if start < len(old):
+            out += '\033[J'
+        self.write(out)
+
+    def _move_back(self, old: str, i: int) -> str:
+        """move the cursor from the end of `old` to its `i`th character, which may be rows above"""
+        width = shutil.get_terminal_size().columns
+        offset = display_width(re.sub(r'\033\[[0-9;]*m', '', self.prompt))
+        end = offset + display_width(old)
+        # after filling the last column the cursor stays on that row
+        end_row = (end - 1) // width
+        row, col = divmod(offset + display_width(old[:i]), width)
+        out = '\r'
+        if end_row > row:
+            out += f'\033[{end_row - row}A'
+        if col:
+            out += f'\033[{col}C'
+        return out
+
+    def render_buffer(self) -> str:
+        if self.highlighter.text != self.buffer:
+            self.highlighter.update(self.buffer, python=self.curr_block is not None)
+        return self.highlighter.render()
     
     def handle_custom_key(self, c) -> bool:
         if sys.platform == 'win32':
@@ -92,7 +124,12 @@ class CarrotShell(Shell):
             c = getwch()
             if c != 91:
                 return
+            # CSI: parameter bytes, then a final byte
+            params = ''
             c = getwch()
+            while 48 <= c <= 63:
+                params += chr(c)
+                c = getwch()
             if c == 65:     # up
                 self.toggle_history(-1)
             elif c == 66:   # down
@@ -101,11 +138,58 @@ class CarrotShell(Shell):
                 pass
             elif c == 68:   # left
                 pass
-            else:
-                raise NotImplementedError
+            elif c == 126 and params == '200':  # bracketed paste
+                self.paste(read_until(PASTE_END))
             return True
         return False
     
+    def process_paste(self, text: str) -> None:
+        lines = (self.buffer + text).rstrip('\n').split('\n')
+        self.buffer = ''
+        if self.curr_block is not None:
+            # in the middle of a block, continue it line by line
+            sys.stdout.write('\r')
+            for line in lines:
+                self.process_line(line)
+            self._write_prompt()
+            return
+
+        # render the whole paste once
+        cont = fmt.gray('... ')
+        echo = '\r\033[K' + self.prompt + lines[0]
+        for line in lines[1:]:
+            echo += '\n' + cont + line
+        self.write(echo + '\n' + BRACKETED_PASTE_OFF)
+
+        for line in lines:
+            if line.strip():
+                self.context.history.append(line)
+        source = '\n'.join(lines)
+        if is_python_block(source, self.context):
+            self._execute(PythonScript(source, mode='exec'))
+        else:
+            for unit in paste_units(lines):
+                if len(unit) > 1:
+                    # an indented block, or a statement continued over several lines
+                    self._execute(PythonScript('\n'.join(unit), mode='exec'))
+                    continue
+                # parsed only now, the lines above may have defined a variable of the same name
+                obj = parse(unit[0], self.context)
+                if isinstance(obj, Block):
+                    error('a pasted block must be valid python')
+                    break
+                self._execute(obj)
+        self._write_prompt()
+
+    def _execute(self, obj: Parsed):
+        try:
+            with watchdog(self.context.watchdog):
+                obj(self.context)
+        except SystemExit:
+            raise
+        except:
+            error(traceback.format_exc(), end='')
+
     def process_line(self, s: str) -> None:
         prompt = self.prompt
 
@@ -134,18 +218,15 @@ class CarrotShell(Shell):
         if obj.icon() is not None:
             prompt = self.prompt[:-2] + obj.icon() + ' '
         print(prompt + obj.string(), flush=True)
-
-        try:
-            obj(self.context)
-        except SystemExit:
-            raise
-        except:
-            error(traceback.format_exc(), end='')
+        self._execute(obj)
 
 def main():
     # set http_proxy=http://127.0.0.1:7890 & set https_proxy=http://127.0.0.1:7890
     os.environ['http_proxy'] = 'http://127.0.0.1:7890'
     os.environ['https_proxy'] = 'http://127.0.0.1:7890'
+    if len(sys.argv) > 1 and sys.argv[1] in ('daemon', 'attach', 'sessions'):
+        from . import daemon
+        sys.exit(daemon.cli(sys.argv[1:]))
     CarrotShell().run()
 
 
@@ -1,10 +1,13 @@
 import traceback
-from .utils import error, warning
-import re, sys, subprocess
+from .utils import error, warning, executables
+import re, sys, ast
 from . import fmt
 from .commands.base import Command, FallbackCommand
 import os
 from .context import Context
+from .template import Template, SubstitutionError, compile_template
+from .interrupt import CommandTimeout, RunCancelled, run_shell
+from .expand import expand_args
 from typing import List
 
 def is_identifier(s: str):
@@ -16,10 +19,8 @@ def has_system_command(cmd: str):
     if sys.platform == 'win32':
         if cmd in ['cls', 'mkdir']:
             return True
-        query = f'where {cmd}'
-    else:
-        query = f'which {cmd}'
-    return subprocess.call(query, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) == 0
+    # re-stat the PATH directories so a freshly installed program is found
+    return executables.lookup(cmd, max_age=0)
 
 def advance_split(s: str):
     """split a string by spaces, but ignore spaces inside quotes"""
@@ -79,42 +80,36 @@ class PythonScript(Parsed):
             error(traceback.format_exc(), end='')
         if code is None:
             return
+        displayhook = sys.displayhook
+        if self.mode == 'single':
+            sys.displayhook = context.display.displayhook
         try:
             exec(code, context.g)
-        except SystemExit:
+        except (SystemExit, CommandTimeout, RunCancelled):
             raise
         except:
             tb = traceback.TracebackException(*sys.exc_info())
             tb.stack.pop(0)     # Skips the first stack frame
             error(''.join(tb.format()), end='')
+        finally:
+            sys.displayhook = displayhook
+            # the script may have touched `os.environ` or `builtins`
+            context.invalidate()
 
-def replace_vars(string: str, context: Context) -> str:
-    def replace(m):
-        key = m.group(1)
-        val = context.get(key)
-        if val is Context.DoesNotExist:
-            raise KeyError(key)
-        return str(val)
+def substitute(template: Template, context: Context) -> str:
     try:
-        cmd = string
-        for pattern in [r'\${(\w+)}', r'\$(\w+)\b']:
-            cmd = re.sub(pattern, replace, cmd)
-        return cmd
+        return template.render(context)
     except KeyError as e:
         error(f'variable {e} does not exist')
-        return string
+    except SubstitutionError as e:
+        error(str(e))
+    return template.s
+
+def replace_vars(string: str, context: Context, exprs: bool = True) -> str:
+    return substitute(compile_template(string, exprs), context)
     
-def fmt_replace_vars(string: str) -> str:
-    def replace(m):
-        return fmt.blue(m.group(0))
-    try:
-        cmd = string
-        for pattern in [r'\${(\w+)}', r'\$(\w+)\b']:
-            cmd = re.sub(pattern, replace, cmd)
-        return fmt.green(cmd)
-    except KeyError as e:
-        error(f'variable {e} does not exist')
-        return string
+def fmt_replace_vars(string: str, exprs: bool = True) -> str:
+    return compile_template(string, exprs).highlight()
 
 class ParsedValue(Parsed):
     def __init__(self, s: str, val):
@@ -122,7 +117,7 @@ class ParsedValue(Parsed):
         self.val = val
 
     def __call__(self, context: Context):
-        print(self.val)
+        context.display.show(self.val)
 
     def string(self) -> str:
         return fmt.blue(self.s)
@@ -135,13 +130,21 @@ class BuiltinCommand(ParsedCommand):
         super().__init__(s)
         self.cmd = cmd
         self.args = args
+        self.templates = [compile_template(arg) for arg in args]
 
-    def __call__(self, context: Context):
+    def _args(self, context: Context) -> List[str]:
+        if not self.cmd.expand_args:
+            return self.args
         args = [
-            replace_vars(arg, context)
-            for arg in self.args
+            substitute(t, context)
+            for t in self.templates
         ]
-        self.cmd(context, *args)
+        if not self.cmd.expand_globs:
+            return args
+        return expand_args(args)
+
+    def __call__(self, context: Context):
+        self.cmd(context, *self._args(context))
 
     def string(self) -> str:
         return fmt_replace_vars(self.s)
@@ -149,10 +152,22 @@ class BuiltinCommand(ParsedCommand):
     def icon(self):
         return '🍋'
 
+class BuiltinQuery(BuiltinCommand):
+    """`name = <builtin line>`, binds the records the command returns"""
+    def __init__(self, s: str, name: str, cmd: Command, args: List[str]):
+        super().__init__(s, cmd, args)
+        self.name = name
+
+    def __call__(self, context: Context):
+        result = self.cmd.query(context, *self._args(context))
+        if result is not None:
+            context.g[self.name] = result
+
 class ShellScript(ParsedCommand):
     def __call__(self, context: Context):
         try:
-            os.system(replace_vars(self.s, context))
+            # `${expr}` is for builtins, the rest of `${...}` is bash's
+            run_shell(replace_vars(self.s, context, exprs=False))
         except KeyboardInterrupt:
             print()
             print('KeyboardInterrupt')
@@ -161,7 +176,7 @@ class ShellScript(ParsedCommand):
         return '🍋'
 
     def string(self) -> str:
-        return fmt_replace_vars(self.s)
+        return fmt_replace_vars(self.s, exprs=False)
 
 class ParsedError(Parsed):
     def __init__(self, s: str, msg: str):
@@ -171,13 +186,22 @@ class ParsedError(Parsed):
     def __call__(self, context: Context):
         error(self.msg)
 
+def builtin(name: str, args: List[str], context: Context):
+    """the builtin for `name`, unless it turns these arguments over to the program on PATH"""
+    cmd = context.commands.get(name)
+    if cmd is None:
+        return None
+    if not cmd.accepts(args) and has_system_command(name):
+        return None
+    return cmd
+
 def parse_single(s: str, context: Context) -> Parsed:
     """parse a single unit"""
     if is_identifier(s):
         val = context.get(s)
         if val is not Context.DoesNotExist:
             return ParsedValue(s, val)
-        cmd = context.commands.get(s)
+        cmd = builtin(s, [], context)
         if cmd is not None:
             return BuiltinCommand(s, cmd, [])
         if has_system_command(s):
@@ -194,7 +218,7 @@ def parse_single(s: str, context: Context) -> Parsed:
 def parse_multi(s: str, units: List[str], context: Context) -> Parsed:
     """parse multiple units"""
     if is_identifier(units[0]):
-        cmd = context.commands.get(units[0])
+        cmd = builtin(units[0], units[1:], context)
         if cmd is not None:
             return BuiltinCommand(s, cmd, units[1:])
         if has_system_command(units[0]):
@@ -236,7 +260,72 @@ class Block:
             else:
                 return True
 
+# lines that belong to the statement above them even though they are not indented
+_continuation = re.compile(r'(else|elif|except|finally)\b|[)\]}]')
+
+def paste_units(lines: List[str]) -> List[List[str]]:
+    """group pasted lines into top-level statements, blank lines are dropped"""
+    units = []
+    for line in lines:
+        if not line.strip():
+            continue
+        if units:
+            last = units[-1]
+            if line[:1].isspace() or _continuation.match(line) or last[-1].rstrip().endswith('\\') \
+                    or all(l.startswith('@') for l in last):
+                last.append(line)
+                continue
+        units.append([line])
+    return units
+
+def is_python_block(s: str, context: Context) -> bool:
+    """whether multiline input should run as one python script rather than unit by unit"""
+    try:
+        tree = ast.parse(s)
+    except SyntaxError:
+        return False
+    units = paste_units(s.split('\n'))
+    # `import os` followed by `ls` runs `ls` as if typed
+    for unit in units:
+        if len(unit) == 1 and isinstance(parse(unit[0], context), ParsedCommand):
+            return False
+    if any(len(unit) > 1 for unit in units):
+        return True
+    # expression-only lines like `1 + 1` echo their values as if typed
+    return not all(isinstance(node, ast.Expr) for node in tree.body)
+
+_binding = re.compile(r'^\s*([A-Za-z_][A-Za-z0-9_]*)\s*=(?!=)\s*(.*)$')
+
+def parse_binding(s: str, context: Context):
+    """`files = ls -l data/` if the right side is a builtin that can be queried, else None"""
+    m = _binding.match(s)
+    if m is None:
+        return None
+    name, rest = m.groups()
+    units = advance_split(rest)
+    if not units or not is_identifier(units[0]):
+        return None
+    word = units[0]
+    # `x = ls` keeps its python meaning when `ls` is a variable
+    if context.get(word) is not Context.DoesNotExist:
+        return None
+    # a program on PATH cannot return records, so `ls` and `du` bind their builtins
+    cmd = context.commands.get(word)
+    if cmd is None:
+        cmd = context.fallback_commands.get(word)
+    if cmd is None or not hasattr(cmd, 'query'):
+        return None
+    return BuiltinQuery(s, name, cmd, units[1:])
+
 def parse(s: str, context: Context) -> Parsed:
+    # `%<line>` is a shorthand for `profile <line>`
+    if s.startswith('%') and 'profile' in context.commands:
+        return BuiltinCommand(s, context.commands['profile'], advance_split(s[1:]))
+
+    parsed = parse_binding(s, context)
+    if parsed is not None:
+        return parsed
+
     units = advance_split(s)
     if len(units) == 0:
         return EmptyScript(s)
@@ -0,0 +1,109 @@
+import cProfile
+import linecache
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from . import fmt
+
+def profile_cpu(fn, top: int = 20, output: str = None):
+    """run `fn` under cProfile and print the `top` functions by cumulative time"""
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        fn()
+    finally:
+        prof.disable()
+        if output:
+            prof.dump_stats(output)
+            print(fmt.gray(f'profile saved to {output}'))
+        stats = pstats.Stats(prof, stream=sys.stdout)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+
+def profile_memory(fn, top: int = 20):
+    """run `fn` under tracemalloc and print the `top` allocation sites"""
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    try:
+        fn()
+    finally:
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if started:
+            tracemalloc.stop()
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        ]
+        stats = after.filter_traces(filters).compare_to(before.filter_traces(filters), 'lineno')
+        total = sum(s.size_diff for s in stats)
+        print(f'{_size(total)} retained, {_size(peak)} peak')
+        for i, s in enumerate(stats[:top]):
+            frame = s.traceback[0]
+            print(f'{i+1:>3}  {_size(s.size_diff):>10}  {s.count_diff:>+8}  {frame.filename}:{frame.lineno}')
+            line = linecache.getline(frame.filename, frame.lineno).strip()
+            if line:
+                print(fmt.gray(f'     {line}'))
+
+def profile_sampling(fn, top: int = 20, interval: float = 0.005):
+    """run `fn` while a background thread samples its stack every `interval` seconds"""
+    ident = threading.get_ident()
+    own = Counter()
+    total = Counter()
+    samples = [0]
+    done = threading.Event()
+
+    def sampler():
+        while not done.wait(interval):
+            frame = sys._current_frames().get(ident)
+            if frame is None:
+                continue
+            samples[0] += 1
+            seen = set()
+            own[_where(frame)] += 1
+            while frame is not None:
+                key = _where(frame)
+                if key not in seen:
+                    seen.add(key)
+                    total[key] += 1
+                frame = frame.f_back
+
+    thread = threading.Thread(target=sampler, daemon=True)
+    start = time.perf_counter()
+    thread.start()
+    try:
+        fn()
+    finally:
+        done.set()
+        thread.join()
+        elapsed = time.perf_counter() - start
+        n = samples[0]
+        print(f'{n} samples in {elapsed:.3f}s')
+        # no `return` in here, it would swallow SystemExit or a timeout from `fn`
+        if n > 0:
+            print(f'{"own":>7} {"total":>7}  function')
+            for key, count in own.most_common(top):
+                print(f'{count/n:>7.1%} {total[key]/n:>7.1%}  {_format_where(key)}')
+
+def _where(frame):
+    code = frame.f_code
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+def _format_where(key) -> str:
+    filename, lineno, name = key
+    return f'{name} ({filename}:{lineno})'
+
+def _size(size: int) -> str:
+    sign = '-' if size < 0 else ''
+    size = abs(size)
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if size < 1024 or unit == 'GiB':
+            return f'{sign}{size:.1f} {unit}' if unit != 'B' else f'{sign}{size} B'
+        size /= 1024
@@ -0,0 +1,226 @@
+import os
+import subprocess
+import threading
+import time
+from . import fmt
+
+_unset = object()
+
+class Segment:
+    """a piece of the prompt, recomputed only when its inputs change
+
+    + `inputs()` must be cheap, it is called for every prompt
+    + `compute(inputs)` does the actual work, in a background thread if `background` is True
+    """
+    background = False
+
+    def __init__(self):
+        self.key = _unset
+        self.value = ''
+        # whether a computation is in flight, and the newest inputs asked for
+        self.running = False
+        self.wanted = None
+        self.finished = 0.0
+        self.on_update = None
+        self.is_idle = lambda: True
+        self.lock = threading.Lock()
+
+    def inputs(self):
+        raise NotImplementedError
+
+    def compute(self, inputs) -> str:
+        raise NotImplementedError
+
+    def keep_stale(self, old, new) -> bool:
+        """whether the old value can be shown while the new one is computing"""
+        return False
+
+    def get(self) -> str:
+        inputs = self.inputs()
+        with self.lock:
+            if inputs == self.key:
+                return self.value
+            if not self.background:
+                self.key = inputs
+                self.value = self.compute(inputs)
+                return self.value
+            self.wanted = inputs
+            # one computation at a time, `_run` picks up inputs that changed meanwhile
+            if not self.running:
+                self._start(inputs)
+            if self.key is not _unset and self.keep_stale(self.key, inputs):
+                return self.value
+            return ''
+
+    def _start(self, inputs):
+        self.running = True
+        threading.Thread(target=self._run, args=(inputs,), daemon=True).start()
+
+    def _run(self, inputs):
+        try:
+            value = self.compute(inputs)
+        except Exception:
+            value = ''
+        with self.lock:
+            self.running = False
+            self.finished = time.monotonic()
+            self.key = inputs
+            changed = value != self.value
+            self.value = value
+            if self.wanted != inputs:
+                self._start(self.wanted)
+        if changed and self.on_update is not None:
+            self.on_update()
+        self.after_run()
+
+    def after_run(self):
+        pass
+
+class CondaSegment(Segment):
+    def inputs(self):
+        return os.environ.get('CONDA_DEFAULT_ENV')
+
+    def compute(self, conda_env) -> str:
+        if conda_env is None:
+            return ''
+        return fmt.gray(f'({conda_env}) ')
+
+class CwdSegment(Segment):
+    def inputs(self):
+        return os.getcwd(), os.environ.get('HOME'), os.environ.get('USERPROFILE')
+
+    def compute(self, inputs) -> str:
+        cwd = inputs[0]
+        home_path = os.path.expanduser('~')
+        if cwd.startswith(home_path):
+            cwd = '~' + cwd[len(home_path):]
+        return fmt.gray(cwd)
+
+def find_git_dir(path: str):
+    """return `(worktree, git_dir)` of the repository containing `path`"""
+    while True:
+        git = os.path.join(path, '.git')
+        if os.path.isdir(git):
+            return path, git
+        if os.path.isfile(git):
+            # worktrees and submodules: "gitdir: <path>"
+            try:
+                with open(git) as f:
+                    line = f.readline().strip()
+            except OSError:
+                return None
+            if line.startswith('gitdir:'):
+                return path, os.path.normpath(os.path.join(path, line[7:].strip()))
+            return None
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+def _mtime(path: str):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+class GitBranchSegment(Segment):
+    """the current branch, read from `.git/HEAD` without spawning git"""
+    def inputs(self):
+        repo = find_git_dir(os.getcwd())
+        if repo is None:
+            return None
+        git_dir = repo[1]
+        return git_dir, _mtime(os.path.join(git_dir, 'HEAD'))
+
+    def compute(self, inputs) -> str:
+        if inputs is None:
+            return ''
+        try:
+            with open(os.path.join(inputs[0], 'HEAD')) as f:
+                head = f.read().strip()
+        except OSError:
+            return ''
+        if head.startswith('ref: refs/heads/'):
+            branch = head[16:]
+        else:
+            branch = head[:7]
+        return fmt.gray(f' {branch}')
+
+class GitDirtySegment(Segment):
+    """`*` if the working tree has changes, computed by `git status` in the background"""
+    background = True
+    # editing a tracked file touches neither HEAD nor the index, so the status is
+    # also rechecked this long after the last check finished, by a timer while idle
+    ttl = 3.0
+
+    def __init__(self):
+        super().__init__()
+        self.round = 0
+        self.timer = None
+
+    def inputs(self):
+        repo = find_git_dir(os.getcwd())
+        if repo is None:
+            return None
+        worktree, git_dir = repo
+        if not self.running and time.monotonic() - self.finished >= self.ttl:
+            self.round += 1
+        return (
+            git_dir,
+            _mtime(os.path.join(git_dir, 'HEAD')),
+            _mtime(os.path.join(git_dir, 'index')),
+            worktree,
+            self.round,
+        )
+
+    def get(self) -> str:
+        value = super().get()
+        # drawing a prompt resumes the rechecks a running command paused
+        self._arm()
+        return value
+
+    def after_run(self):
+        self._arm()
+
+    def _arm(self):
+        with self.lock:
+            if self.timer is not None or self.running or self.key in (None, _unset):
+                return
+            delay = max(self.ttl - (time.monotonic() - self.finished), 0.0)
+            self.timer = threading.Timer(delay, self._tick)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _tick(self):
+        with self.lock:
+            self.timer = None
+        # a running command gets no `git status` underneath it, the next prompt rechecks
+        if self.is_idle():
+            self.get()
+
+    def keep_stale(self, old, new) -> bool:
+        return old is not None and new is not None and old[0] == new[0]
+
+    def compute(self, inputs) -> str:
+        if inputs is None:
+            return ''
+        try:
+            out = subprocess.run(
+                # no `index.lock`, the user may be running git at the same time
+                ['git', '--no-optional-locks', 'status', '--porcelain', '--ignore-submodules=dirty'],
+                cwd=inputs[3], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            ).stdout
+        except OSError:
+            return ''
+        return fmt.gray('*') if out.strip() else ''
+
+class Prompt:
+    def __init__(self, segments, on_update=None, is_idle=None):
+        self.segments = segments
+        for seg in segments:
+            seg.on_update = on_update
+            if is_idle is not None:
+                seg.is_idle = is_idle
+
+    def render(self) -> str:
+        return ''.join(seg.get() for seg in self.segments)
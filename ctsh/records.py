@@ -0,0 +1,299 @@
+"""column-oriented tables for builtin results bound to python variables
+
+    files = ls -l data/
+    big = files[files['size'] > 1 << 20].sort('size', reverse=True)
+    big['size'].sum()
+
+Numbers are kept in `array.array` and strings in one utf-8 blob with an offsets array, so a
+million rows take tens of MB instead of a python object per field. Comparisons on a column
+give a `Mask` that selects rows, and the loops run inside `map` and `itertools`.
+"""
+import array
+import itertools
+import operator
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+_NOT = bytes.maketrans(b'\0\1', b'\1\0')
+_BATCH = 4096
+
+class Mask(bytearray):
+    """one byte per row, 1 where a condition holds, combine with `&`, `|` and `~`"""
+    def _combine(self, other, op):
+        if len(self) != len(other):
+            raise ValueError(f'masks of {len(self)} and {len(other)} rows')
+        # whole-mask bitwise operations run on big ints
+        a = int.from_bytes(self, 'little')
+        b = int.from_bytes(other, 'little')
+        return Mask(op(a, b).to_bytes(len(self), 'little'))
+
+    def __and__(self, other):
+        return self._combine(other, operator.and_)
+
+    def __or__(self, other):
+        return self._combine(other, operator.or_)
+
+    def __xor__(self, other):
+        return self._combine(other, operator.xor)
+
+    def __invert__(self):
+        return Mask(self.translate(_NOT))
+
+    def __repr__(self):
+        return f'<Mask {self.count(1)} of {len(self)} rows>'
+
+class Column:
+    """a numeric column backed by an `array.array`"""
+    def __init__(self, name: str, data: array.array):
+        self.name = name
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __getitem__(self, i):
+        return self.data[i]
+
+    def _compare(self, op, value) -> Mask:
+        return Mask(map(op, self.data, itertools.repeat(value)))
+
+    def __lt__(self, value):
+        return self._compare(operator.lt, value)
+
+    def __le__(self, value):
+        return self._compare(operator.le, value)
+
+    def __gt__(self, value):
+        return self._compare(operator.gt, value)
+
+    def __ge__(self, value):
+        return self._compare(operator.ge, value)
+
+    def __eq__(self, value):
+        return self._compare(operator.eq, value)
+
+    def __ne__(self, value):
+        return self._compare(operator.ne, value)
+
+    __hash__ = None
+
+    def __invert__(self):
+        """rows where the value is zero, `~files['is_dir']`"""
+        return Mask(map(operator.not_, self.data))
+
+    def mask(self) -> Mask:
+        """rows where the value is non-zero"""
+        return Mask(map(bool, self.data))
+
+    def sum(self):
+        return sum(self.data)
+
+    def min(self):
+        return min(self.data)
+
+    def max(self):
+        return max(self.data)
+
+    def mean(self):
+        return sum(self.data) / len(self.data) if self.data else float('nan')
+
+    def sort_key(self):
+        return self.data.__getitem__
+
+    def take(self, indices):
+        return Column(self.name, array.array(self.data.typecode, map(self.data.__getitem__, indices)))
+
+    def compress(self, mask: Mask):
+        return Column(self.name, array.array(self.data.typecode, itertools.compress(self.data, mask)))
+
+    def __repr__(self):
+        return f'<Column {self.name}: {len(self)} values>'
+
+class StrColumn(Column):
+    """strings joined in one utf-8 blob, `offsets[i]:offsets[i+1]` is the i-th one"""
+    def __init__(self, name: str, blob: bytearray, offsets: array.array):
+        self.name = name
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _get(self, i: int) -> str:
+        return self.blob[self.offsets[i]:self.offsets[i+1]].decode('utf-8', 'surrogateescape')
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._get(i)
+
+    def __iter__(self):
+        blob, offsets = self.blob, self.offsets
+        for i in range(len(self)):
+            yield blob[offsets[i]:offsets[i+1]].decode('utf-8', 'surrogateescape')
+
+    def _compare(self, op, value) -> Mask:
+        return Mask(map(op, self, itertools.repeat(value)))
+
+    def startswith(self, prefix) -> Mask:
+        return Mask(map(operator.methodcaller('startswith', prefix), self))
+
+    def endswith(self, suffix) -> Mask:
+        return Mask(map(operator.methodcaller('endswith', suffix), self))
+
+    def contains(self, s: str) -> Mask:
+        return Mask(map(operator.contains, self, itertools.repeat(s)))
+
+    def match(self, pattern: str) -> Mask:
+        """glob match like `*.py`"""
+        from .expand import translate
+        regex = translate(pattern)
+        return Mask(m is not None for m in map(regex.match, self))
+
+    def search(self, pattern: str) -> Mask:
+        """regular expression search"""
+        return Mask(m is not None for m in map(re.compile(pattern).search, self))
+
+    def sum(self):
+        raise TypeError(f'cannot sum the string column {repr(self.name)}')
+
+    def sort_key(self):
+        return self._get
+
+    def take(self, indices):
+        blob, offsets = self.blob, self.offsets
+        out = bytearray()
+        ends = array.array('Q', [0])
+        for i in indices:
+            out += blob[offsets[i]:offsets[i+1]]
+            ends.append(len(out))
+        return StrColumn(self.name, out, ends)
+
+    def compress(self, mask: Mask):
+        return self.take(itertools.compress(range(len(self)), mask))
+
+@lru_cache(maxsize=64)
+def _row_type(names):
+    return namedtuple('Row', names, rename=True)
+
+class Table:
+    """rows with named, typed columns
+
+    `schema` is a list of `(name, typecode)`, where the typecode is an `array` typecode or
+    `'s'` for strings. A table made from a row iterator reads it on first use, or when
+    `load` is called. Builtins load before returning, so a bound table is a snapshot.
+    """
+    def __init__(self, schema, rows=None, columns=None):
+        self.schema = [(name, code) for name, code in schema]
+        self._columns = columns
+        self._rows = rows
+
+    def _load(self):
+        if self._columns is not None:
+            return self._columns
+        data = []
+        for name, code in self.schema:
+            if code == 's':
+                data.append((bytearray(), array.array('Q', [0])))
+            else:
+                data.append(array.array(code))
+        rows = iter(self._rows or ())
+        while True:
+            batch = list(itertools.islice(rows, _BATCH))
+            if not batch:
+                break
+            # append column-wise, the per-field work happens in `extend`
+            for (name, code), values, col in zip(self.schema, zip(*batch), data):
+                if code == 's':
+                    blob, offsets = col
+                    encoded = [v.encode('utf-8', 'surrogateescape') for v in values]
+                    blob += b''.join(encoded)
+                    offsets.extend(itertools.islice(itertools.accumulate(map(len, encoded), initial=offsets[-1]), 1, None))
+                else:
+                    col.extend(values)
+        columns = {}
+        for (name, code), col in zip(self.schema, data):
+            columns[name] = StrColumn(name, *col) if code == 's' else Column(name, col)
+        self._columns = columns
+        self._rows = None
+        return columns
+
+    def load(self):
+        """read the rows now, returns the table"""
+        self._load()
+        return self
+
+    def _derive(self, columns):
+        return Table(self.schema, columns={c.name: c for c in columns})
+
+    @property
+    def columns(self):
+        return [name for name, _ in self.schema]
+
+    def __len__(self):
+        columns = self._load()
+        return len(next(iter(columns.values()))) if columns else 0
+
+    def __getitem__(self, key):
+        columns = self._load()
+        if isinstance(key, str):
+            return columns[key]
+        if isinstance(key, Mask):
+            return self.filter(key)
+        if isinstance(key, Column):
+            return self.filter(key.mask())
+        if isinstance(key, int):
+            return _row_type(tuple(self.columns))(*(c[key] for c in columns.values()))
+        if isinstance(key, slice):
+            return self._derive(c.take(range(len(self))[key]) for c in columns.values())
+        if isinstance(key, (list, tuple)):
+            codes = dict(self.schema)
+            return Table([(n, codes[n]) for n in key], columns={n: columns[n] for n in key})
+        raise TypeError(f'cannot index a table with {type(key).__name__}')
+
+    def __iter__(self):
+        columns = self._load()
+        return map(_row_type(tuple(self.columns))._make, zip(*columns.values()))
+
+    def filter(self, mask: Mask):
+        columns = self._load()
+        if len(mask) != len(self):
+            raise ValueError(f'mask of {len(mask)} rows for a table of {len(self)}')
+        return self._derive(c.compress(mask) for c in columns.values())
+
+    def sort(self, by, reverse: bool = False):
+        """a new table ordered by one column name or a list of them"""
+        columns = self._load()
+        order = range(len(self))
+        # stable sorts from the last key to the first
+        for name in reversed([by] if isinstance(by, str) else list(by)):
+            order = sorted(order, key=columns[name].sort_key(), reverse=reverse)
+        return self._derive(c.take(order) for c in columns.values())
+
+    def head(self, n: int = 10):
+        return self[:n]
+
+    def sum(self, column: str):
+        return self[column].sum()
+
+    def __repr__(self):
+        columns = self._load()
+        n = len(self)
+        shown = min(n, 20)
+        names = self.columns
+        cells = [[str(c[i]) for c in columns.values()] for i in range(shown)]
+        widths = [max([len(name)] + [len(row[j]) for row in cells]) for j, name in enumerate(names)]
+        numeric = [code != 's' for _, code in self.schema]
+        def line(values):
+            return '  '.join(v.rjust(w) if num else v.ljust(w) for v, w, num in zip(values, widths, numeric)).rstrip()
+        out = [line(names)] + [line(row) for row in cells]
+        if n > shown:
+            out.append(f'... {n - shown} more rows')
+        out.append(f'[{n} rows x {len(names)} columns]')
+        return '\n'.join(out)
@@ -0,0 +1,112 @@
+import re
+from functools import lru_cache
+from . import fmt
+
+# `${...}` or `$name`
+_token = re.compile(r'\$(?:{([^{}]*)}|(\w+))')
+_name_default = re.compile(r'^(\w+):-(.*)$', re.S)
+
+class SubstitutionError(Exception):
+    pass
+
+class Var:
+    """`$name` or `${name}`"""
+    def __init__(self, source: str, name: str):
+        self.source = source
+        self.name = name
+
+    def resolve(self, context) -> str:
+        val = context.get(self.name)
+        if val is context.DoesNotExist:
+            raise KeyError(self.name)
+        return str(val)
+
+class VarDefault(Var):
+    """`${name:-default}`, use `default` if `name` is unset or empty"""
+    def __init__(self, source: str, name: str, default: str):
+        super().__init__(source, name)
+        self.default = default
+
+    def resolve(self, context) -> str:
+        val = context.get(self.name)
+        if val is context.DoesNotExist:
+            return self.default
+        val = str(val)
+        return val if val else self.default
+
+class Expr:
+    """`${expr}`, a python expression evaluated in `context.g`"""
+    def __init__(self, source: str, code):
+        self.source = source
+        self.code = code
+
+    def resolve(self, context) -> str:
+        try:
+            return str(eval(self.code, context.g))
+        except Exception as e:
+            raise SubstitutionError(f'bad substitution {self.source}: {type(e).__name__}: {e}')
+
+class Template:
+    """a string split once into literal and variable segments
+
+    with `exprs` False, a `${...}` that is not `${name}` or `${name:-default}` is kept as
+    it is, so bash expansions like `${v%.txt}` or `${v/a/b}` reach the shell untouched
+    """
+    def __init__(self, s: str, exprs: bool = True):
+        self.s = s
+        self.segments = []
+        i = 0
+        for m in _token.finditer(s):
+            seg = self._compile(m, exprs)
+            if seg is None:
+                continue
+            if m.start() > i:
+                self.segments.append(s[i:m.start()])
+            self.segments.append(seg)
+            i = m.end()
+        if i < len(s):
+            self.segments.append(s[i:])
+        self.has_vars = any(not isinstance(seg, str) for seg in self.segments)
+
+    @staticmethod
+    def _compile(m, exprs: bool):
+        source = m.group(0)
+        if m.group(2) is not None:
+            return Var(source, m.group(2))
+        body = m.group(1)
+        if re.match(r'^\w+$', body):
+            return Var(source, body)
+        md = _name_default.match(body)
+        if md is not None:
+            return VarDefault(source, md.group(1), md.group(2))
+        if not exprs:
+            return None
+        try:
+            return Expr(source, compile(body.strip(), '<expr>', 'eval'))
+        except SyntaxError:
+            # not an expression, keep it as a literal
+            return None
+
+    def render(self, context) -> str:
+        if not self.has_vars:
+            return self.s
+        parts = []
+        for seg in self.segments:
+            if isinstance(seg, str):
+                parts.append(seg)
+            else:
+                parts.append(seg.resolve(context))
+        return ''.join(parts)
+
+    def highlight(self) -> str:
+        parts = []
+        for seg in self.segments:
+            if isinstance(seg, str):
+                parts.append(seg)
+            else:
+                parts.append(fmt.blue(seg.source))
+        return fmt.green(''.join(parts))
+
+@lru_cache(maxsize=4096)
+def compile_template(s: str, exprs: bool = True) -> Template:
+    return Template(s, exprs)
@@ -1,6 +1,9 @@
 import re, os
 import sys
+import time
 import ctypes
+import threading
+import unicodedata
 from .completer import PathCompleter
 
 def error(msg: str, end='\n'):
@@ -17,24 +20,137 @@ import sys
 if sys.platform == 'win32':
     libc = ctypes.cdll.msvcrt
     getwch = libc._getwch
+
+    def read_until(terminator: str) -> str:
+        """read raw input up to `terminator`, which is consumed but not returned"""
+        buf = ''
+        while not buf.endswith(terminator):
+            buf += chr(getwch())
+        return buf[:-len(terminator)]
 else:
     libc = ctypes.cdll.LoadLibrary(None)
-    import termios, tty
-    def getwch():
-        try:
-            # disable echo
-            fd = sys.stdin.fileno()
-            old = termios.tcgetattr(fd)
-            new = termios.tcgetattr(fd)
+    import termios, tty, codecs, collections
+    # bytes are read in chunks, decoded characters wait here
+    _pending = collections.deque()
+    _decoder = codecs.getincrementaldecoder('utf-8')('replace')
+
+    class _cbreak:
+        """disable echo and line buffering while reading keys"""
+        def __enter__(self):
+            self.fd = sys.stdin.fileno()
+            self.old = termios.tcgetattr(self.fd)
+            new = termios.tcgetattr(self.fd)
             new[3] &= ~termios.ECHO
-            termios.tcsetattr(fd, termios.TCSANOW, new)
-            tty.setcbreak(sys.stdin.fileno(), termios.TCSANOW)
-            # read wchar with no buffer
-            c = libc.getwchar()
-        finally:
+            termios.tcsetattr(self.fd, termios.TCSANOW, new)
+            tty.setcbreak(self.fd, termios.TCSANOW)
+            return self.fd
+
+        def __exit__(self, *exc):
             # restore echo
-            termios.tcsetattr(fd, termios.TCSANOW, old)
-        return c
+            termios.tcsetattr(self.fd, termios.TCSANOW, self.old)
+
+    def _read(fd: int) -> str:
+        data = os.read(fd, 65536)
+        if not data:
+            raise EOFError
+        return _decoder.decode(data)
+
+    def getwch():
+        with _cbreak() as fd:
+            while not _pending:
+                _pending.extend(_read(fd))
+        return ord(_pending.popleft())
+
+    def read_until(terminator: str) -> str:
+        """read raw input up to `terminator`, which is consumed but not returned"""
+        with _cbreak() as fd:
+            buf = ''.join(_pending)
+            _pending.clear()
+            start = 0
+            while True:
+                i = buf.find(terminator, start)
+                if i != -1:
+                    break
+                start = max(len(buf) - len(terminator) + 1, 0)
+                buf += _read(fd)
+        _pending.extend(buf[i+len(terminator):])
+        return buf[:i]
+
+# https://invisible-island.net/xterm/ctlseqs/ctlseqs.html#h2-Bracketed-Paste-Mode
+if sys.platform == 'win32':
+    BRACKETED_PASTE_ON = BRACKETED_PASTE_OFF = ''
+else:
+    BRACKETED_PASTE_ON = '\033[?2004h'
+    BRACKETED_PASTE_OFF = '\033[?2004l'
+PASTE_START = '\033[200~'
+PASTE_END = '\033[201~'
+
+class ExecutableTable:
+    """names of the executables on PATH, rescanned when PATH or one of its directories changes"""
+    def __init__(self):
+        self.path = None
+        self.mtimes = None
+        self.names = frozenset()
+        self.checked = 0.0
+
+    def lookup(self, name: str, max_age: float = 2.0) -> bool:
+        """whether `name` is on PATH, directories are stat-ed at most every `max_age` seconds"""
+        self.refresh(max_age)
+        return self.known(name)
+
+    def refresh(self, max_age: float = 2.0):
+        now = time.monotonic()
+        path = os.environ.get('PATH', '')
+        if path != self.path or now - self.checked >= max_age:
+            self.checked = now
+            self._refresh(path)
+
+    def known(self, name: str) -> bool:
+        """`lookup` without touching the filesystem, as of the last refresh"""
+        if sys.platform == 'win32':
+            name = name.lower()
+        return name in self.names
+
+    def _refresh(self, path: str):
+        dirs = list(dict.fromkeys(d for d in path.split(os.pathsep) if d))
+        mtimes = []
+        for d in dirs:
+            try:
+                mtimes.append(os.stat(d).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        if path == self.path and mtimes == self.mtimes:
+            return
+        self.path, self.mtimes = path, mtimes
+        if sys.platform == 'win32':
+            exts = {e.lower() for e in os.environ.get('PATHEXT', '.COM;.EXE;.BAT;.CMD').split(';') if e}
+        names = set()
+        for d in dirs:
+            try:
+                it = os.scandir(d)
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    if sys.platform == 'win32':
+                        stem, ext = os.path.splitext(entry.name.lower())
+                        if ext in exts:
+                            names.add(stem)
+                        continue
+                    try:
+                        if entry.is_file() and entry.stat().st_mode & 0o111:
+                            names.add(entry.name)
+                    except OSError:
+                        pass
+        self.names = frozenset(names)
+
+executables = ExecutableTable()
+
+def display_width(s: str) -> int:
+    """terminal columns taken by `s`, wide east asian characters and emoji take two"""
+    if s.isascii():
+        return len(s)
+    return sum(2 if unicodedata.east_asian_width(c) in 'WF' else 1 for c in s)
 
 def estimate_terminal_lines(string: str) -> int:
     if len(string) == 0:
@@ -47,6 +163,9 @@ class Shell:
         self.buffer = ''
         self.prompt = None
         self.completer = None
+        # `idle` is True while waiting for a key, only then may other threads repaint
+        self.lock = threading.RLock()
+        self.idle = False
 
     def process_line(self, s: str) -> None:
         print(s, flush=True)
@@ -55,12 +174,50 @@ class Shell:
         return '>> '
 
     def _write_prompt(self):
+        # keystrokes only read the table, a new program shows up from the next prompt
+        executables.refresh()
         self.prompt = self.get_prompt()
-        self.write(self.prompt)
+        self.write(BRACKETED_PASTE_ON + self.prompt)
 
     def write(self, s: str):
-        sys.stdout.write(s)
-        sys.stdout.flush()
+        with self.lock:
+            sys.stdout.write(s)
+            sys.stdout.flush()
+
+    def repaint_prompt(self):
+        """redraw the prompt and the current input, called from other threads"""
+        with self.lock:
+            if not self.idle or self.prompt is None:
+                return
+            prompt = self.get_prompt()
+            if prompt == self.prompt:
+                return
+            # only a single terminal line can be redrawn in place
+            visible = re.sub(r'\033\[[0-9;]*m', '', prompt)
+            if estimate_terminal_lines(visible + self.buffer) > 1:
+                return
+            self.prompt = prompt
+            self.write('\r' + prompt + self.render_buffer() + '\033[K')
+
+    def set_buffer(self, s: str):
+        """replace the input line and redraw what changed"""
+        with self.lock:
+            old, self.buffer = self.buffer, s
+            self.redraw(old)
+
+    def redraw(self, old: str):
+        """update the screen from `old` to `self.buffer`, the cursor is at the end of the line"""
+        i = 0
+        for a, b in zip(old, self.buffer):
+            if a != b:
+                break
+            i += 1
+        if i < len(old):
+            self.backspace_s(old[i:])
+        self.write(self.buffer[i:])
+
+    def render_buffer(self) -> str:
+        return self.buffer
 
     def backspace_s(self, s: str):
         back_counts = len(s.encode('gbk'))
@@ -69,15 +226,45 @@ class Shell:
     def handle_custom_key(self, c) -> bool:
         return False
 
+    def paste(self, text: str):
+        """handle a bracketed paste, the whole payload arrives at once"""
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+        if '\n' in text.strip('\n'):
+            self.process_paste(text)
+            return
+        text = ''.join(c for c in text.strip('\n') if c.isprintable())
+        self.completer = None
+        self.set_buffer(self.buffer + text)
+
+    def process_paste(self, text: str) -> None:
+        """run a multiline paste, the current buffer is its first line"""
+        self.write('\n')
+        for line in (self.buffer + text).split('\n'):
+            self.process_line(line)
+        self.buffer = ''
+        self._write_prompt()
+
     def run(self):
+        try:
+            self._run()
+        except EOFError:
+            pass
+        finally:
+            self.write(BRACKETED_PASTE_OFF)
+
+    def _run(self):
         self._write_prompt()
         while True:
             try:
+                self.idle = True
                 c: int = getwch()
                 if c == 3: raise KeyboardInterrupt
             except KeyboardInterrupt:
                 print('KeyboardInterrupt', end='')
                 c = ord('\n')
+            finally:
+                with self.lock:
+                    self.idle = False
 
             if self.handle_custom_key(c):
                 continue
@@ -86,8 +273,7 @@ class Shell:
             if c == '\b' or c == '\x7f':
                 self.completer = None
                 if self.buffer:
-                    removed = self.buffer[-1]; self.buffer = self.buffer[:-1]
-                    self.backspace_s(removed)
+                    self.set_buffer(self.buffer[:-1])
                     continue
             if c in ('\r', '\n'):
                 self.completer = None
@@ -99,6 +285,8 @@ class Shell:
                     for _ in range(lines - 1):
                         sys.stdout.write('\033[F')
 
+                # commands should not receive paste markers
+                sys.stdout.write(BRACKETED_PASTE_OFF)
                 self.process_line(self.buffer)
                 self.buffer = ''
                 self._write_prompt()
@@ -112,11 +300,8 @@ class Shell:
                     completed = self.completer.next()
                     if completed:
                         old, new = completed
-                        self.backspace_s(old)
-                        self.write(new)
-                        self.buffer = self.buffer[:-len(old)] + new
+                        self.set_buffer(self.buffer[:-len(old)] + new)
             else:
                 self.completer = None
                 if 32 <= ord(c) <= 126 or ord(c) > 127:
-                    self.write(c)
-                    self.buffer += c
\ No newline at end of file
+                    self.set_buffer(self.buffer + c)
\ No newline at end of file
@@ -0,0 +1,228 @@
+"""file change notification for the `watch` builtin
+
+`InotifyWatcher` registers one inotify watch per directory through the ctypes libc handle,
+so an idle watch costs nothing however many files there are. `PollingWatcher` compares
+`(mtime, size)` snapshots instead, on platforms or filesystems without inotify.
+"""
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from .utils import libc
+
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# a save is a close after writing or a rename into place, `touch` only changes attributes
+_MASK = (
+    IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+)
+_event = struct.Struct('iIII')
+
+class Root:
+    """a watched path, a file is watched through its directory so that replacing it is seen"""
+    def __init__(self, path: str, ignore=None):
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            self.dir, self.name = path, None
+        else:
+            self.dir, self.name = os.path.dirname(path), os.path.basename(path)
+        self.ignore = ignore
+
+    def wants(self, path: str, is_dir: bool) -> bool:
+        rel = os.path.relpath(path, self.dir).replace(os.sep, '/')
+        if rel.startswith('..'):
+            return False
+        if self.name is not None:
+            return rel == self.name
+        return self.ignore is None or not self.ignore.ignored(rel, is_dir)
+
+    def dirs(self):
+        """the directories to watch, ignored ones are pruned"""
+        yield self.dir
+        if self.name is not None:
+            return
+        stack = [self.dir]
+        while stack:
+            try:
+                it = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    try:
+                        if not entry.is_dir(follow_symlinks=False):
+                            continue
+                    except OSError:
+                        continue
+                    if self.wants(entry.path, True):
+                        stack.append(entry.path)
+                        yield entry.path
+
+class InotifyWatcher:
+    def __init__(self, roots):
+        self.roots = roots
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError('inotify_init1 failed')
+        self.wds = {}
+        try:
+            for root in roots:
+                for path in root.dirs():
+                    self._add(path, root)
+        except BaseException:
+            self.close()
+            raise
+
+    def _add(self, path: str, root: Root):
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(path), _MASK)
+        if wd < 0:
+            if not os.path.isdir(path):
+                # removed before we got to it
+                return
+            raise OSError(f'inotify_add_watch failed for {path}, check fs.inotify.max_user_watches')
+        self.wds[wd] = (path, root)
+
+    def read(self, timeout: float):
+        """wait up to `timeout` seconds, return the changed paths"""
+        r, _, _ = select.select([self.fd], [], [], timeout)
+        if not r:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        changes = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, size = _event.unpack_from(data, pos)
+            name = data[pos+_event.size:pos+_event.size+size].rstrip(b'\0')
+            pos += _event.size + size
+            if mask & IN_Q_OVERFLOW:
+                # events were dropped, something changed
+                changes.append(self.roots[0].dir)
+                continue
+            watched = self.wds.get(wd)
+            if watched is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.wds[wd]
+                continue
+            directory, root = watched
+            path = os.path.join(directory, os.fsdecode(name)) if name else directory
+            is_dir = bool(mask & IN_ISDIR)
+            if name and not root.wants(path, is_dir):
+                continue
+            if is_dir and mask & (IN_CREATE | IN_MOVED_TO) and root.name is None:
+                self._add_tree(path, root)
+            changes.append(path)
+        return changes
+
+    def _add_tree(self, path: str, root: Root):
+        for d in Root(path).dirs():
+            if root.wants(d, True):
+                try:
+                    self._add(d, root)
+                except OSError:
+                    pass
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+class PollingWatcher:
+    def __init__(self, roots, interval: float = 1.0):
+        self.roots = roots
+        self.interval = interval
+        self.snapshot = self._scan()
+        self.next_scan = time.monotonic() + interval
+
+    def _scan(self):
+        snapshot = {}
+        for root in self.roots:
+            for d in root.dirs():
+                try:
+                    it = os.scandir(d)
+                except OSError:
+                    continue
+                with it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                continue
+                            st = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        if root.wants(entry.path, False):
+                            snapshot[entry.path] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def read(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            if now >= self.next_scan:
+                self.next_scan = now + self.interval
+                snapshot = self._scan()
+                old, self.snapshot = self.snapshot, snapshot
+                changes = [p for p in snapshot.keys() | old.keys() if snapshot.get(p) != old.get(p)]
+                if changes:
+                    return changes
+            if now >= deadline:
+                return []
+            time.sleep(max(min(self.next_scan, deadline) - now, 0))
+
+    def close(self):
+        pass
+
+def open_watcher(roots, poll: bool = False, interval: float = 1.0):
+    """an inotify watcher where possible, else a polling one"""
+    if not poll and sys.platform.startswith('linux') and hasattr(libc, 'inotify_init1'):
+        try:
+            return InotifyWatcher(roots)
+        except OSError as e:
+            from .utils import warning
+            warning(f'watch: {e}, polling instead')
+    return PollingWatcher(roots, interval)
+
+class WatchThread(threading.Thread):
+    """calls `on_change(paths)` once a burst of changes has been quiet for `debounce` seconds"""
+    def __init__(self, watcher, debounce: float, on_change):
+        super().__init__(daemon=True)
+        self.watcher = watcher
+        self.debounce = debounce
+        self.on_change = on_change
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            changes = self.watcher.read(0.5)
+            if not changes:
+                continue
+            while not self.stopped.is_set():
+                more = self.watcher.read(self.debounce)
+                if not more:
+                    break
+                changes.extend(more)
+            if not self.stopped.is_set():
+                self.on_change(list(dict.fromkeys(changes)))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.watcher.close()
@@ -0,0 +1,310 @@
+"""performance benchmarks for carrot-shell
+
+    python scripts/bench.py -o bench.json
+    python scripts/bench.py --compare bench.json
+
+interactive benchmarks drive `python -m ctsh` through a pseudo-terminal (posix only),
+microbenchmarks call the parser and builtins directly on generated trees
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import re
+import select
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import unicodedata
+from contextlib import redirect_stdout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PROMPT = '🥕 '.encode()
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'median_ms': statistics.median(samples) * 1000,
+        'p90_ms': samples[min(int(len(samples) * 0.9), len(samples) - 1)] * 1000,
+        'n': len(samples),
+    }
+
+def timeit(fn, repeat: int):
+    fn()    # warm up
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+# ---------------------------------------------------------------------------
+# generated trees
+
+def make_tree(root: str, depth: int, width: int, files: int):
+    """`width` subdirectories per level, `files` files of 1 KiB per directory"""
+    def build(path, level):
+        os.makedirs(path, exist_ok=True)
+        for i in range(files):
+            with open(os.path.join(path, f'file_{i}.txt'), 'wb') as f:
+                f.write(b'x' * 1024)
+        if level < depth:
+            for i in range(width):
+                build(os.path.join(path, f'dir_{i}'), level + 1)
+    build(root, 0)
+
+def make_flat(root: str, count: int):
+    os.makedirs(root, exist_ok=True)
+    for i in range(count):
+        open(os.path.join(root, f'item_{i:06d}.dat'), 'wb').close()
+
+# ---------------------------------------------------------------------------
+# pty driver
+
+_csi = re.compile(r'\033\[([0-9;?]*)([A-Za-z])')
+
+def screen_line(out: bytes) -> str:
+    """the text of the last terminal line, following carriage returns, cursor moves and erases"""
+    text = out[out.rfind(b'\n') + 1:].decode('utf-8', 'replace')
+    cells = []
+    pos = 0
+    i = 0
+    for m in _csi.finditer(text + '\033[0m'):
+        for c in text[i:m.start()]:
+            if c == '\r':
+                pos = 0
+                continue
+            if c == '\b':
+                pos = max(pos - 1, 0)
+                continue
+            width = 2 if unicodedata.east_asian_width(c) in 'WF' else 1
+            cells[pos:pos + width] = [c] + [''] * (width - 1)
+            pos += width
+        i = m.end()
+        arg, op = m.groups()
+        n = int(arg) if arg.isdigit() else 1
+        if op == 'C':
+            pos += n
+            cells.extend([' '] * (pos - len(cells)))
+        elif op == 'D':
+            pos = max(pos - n, 0)
+        elif op in 'JK':
+            del cells[pos:]
+    return ''.join(cells)
+
+class Terminal:
+    def __init__(self, cwd: str, cols: int = 200, rows: int = 50):
+        import pty, fcntl, termios, struct
+        env = dict(os.environ)
+        env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+        env.pop('CTSH_FIRST_RUN_FLAG', None)
+        self.start = time.perf_counter()
+        self.pid, self.fd = pty.fork()
+        if self.pid == 0:
+            os.chdir(cwd)
+            os.execvpe(sys.executable, [sys.executable, '-m', 'ctsh'], env)
+        fcntl.ioctl(self.fd, termios.TIOCSWINSZ, struct.pack('HHHH', rows, cols, 0, 0))
+        self.out = bytearray()
+
+    def read_until(self, pred, timeout: float = 30):
+        deadline = time.perf_counter() + timeout
+        while not pred(self.out):
+            left = deadline - time.perf_counter()
+            if left <= 0:
+                raise TimeoutError(bytes(self.out[-200:]))
+            r, _, _ = select.select([self.fd], [], [], left)
+            if r:
+                self.out += os.read(self.fd, 65536)
+        return time.perf_counter()
+
+    def send(self, s: str):
+        os.write(self.fd, s.encode())
+
+    def wait_prompt(self):
+        return self.read_until(lambda out: out.endswith(PROMPT))
+
+    def run(self, line: str) -> float:
+        """type a line, return the seconds from Enter to the next prompt"""
+        self.send(line)
+        # the echo is colored and partly redrawn, compare what the line shows
+        self.read_until(lambda out: screen_line(out).endswith(line))
+        self.out.clear()
+        start = time.perf_counter()
+        self.send('\r')
+        return self.wait_prompt() - start
+
+    def close(self):
+        import signal
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+            os.waitpid(self.pid, 0)
+        except OSError:
+            pass
+        os.close(self.fd)
+
+def bench_interactive(workdir: str, repeat: int):
+    results = {}
+    samples = []
+    for _ in range(max(repeat // 5, 3)):
+        term = Terminal(workdir)
+        samples.append(term.wait_prompt() - term.start)
+        term.close()
+    results['startup'] = summarize(samples)
+
+    term = Terminal(workdir)
+    try:
+        term.wait_prompt()
+        term.run('x = 1')
+
+        samples = []
+        for i in range(repeat):
+            # let the shell get back to waiting for a key
+            time.sleep(0.01)
+            term.out.clear()
+            start = time.perf_counter()
+            term.send('a')
+            samples.append(term.read_until(lambda out: b'a' in out) - start)
+        results['keystroke_echo'] = summarize(samples)
+        term.send('\x7f' * repeat)
+        time.sleep(0.2)
+
+        lines = {
+            'enter_variable': 'x',
+            'enter_builtin': 'pwd',
+            'enter_path_command': 'true',
+            'enter_python': 'y = [i for i in range(100)]',
+        }
+        for name, line in lines.items():
+            results[name] = summarize([term.run(line) for _ in range(repeat)])
+
+        samples = []
+        for _ in range(repeat):
+            term.send('ls big/item_0001')
+            term.read_until(lambda out: out.endswith(b'item_0001'))
+            term.out.clear()
+            start = time.perf_counter()
+            term.send('\t')
+            samples.append(term.read_until(lambda out: b'item_0001' in out) - start)
+            term.send('\x7f' * 64)
+            time.sleep(0.05)
+        results['tab_completion_10k'] = summarize(samples)
+    finally:
+        term.close()
+    return results
+
+# ---------------------------------------------------------------------------
+# microbenchmarks
+
+def bench_micro(workdir: str, repeat: int):
+    from ctsh.context import Context
+    from ctsh.parser import advance_split, parse, replace_vars
+    from ctsh.commands import base
+
+    context = Context()
+    for _, obj in base.__dict__.items():
+        if isinstance(obj, type) and issubclass(obj, base.Command):
+            context.register_command(obj())
+    context['name'] = 'world'
+    context['n'] = 42
+
+    results = {}
+    line = 'cp -r "some dir/with spaces" dst/$name ${n} --flag value ' * 4
+    results['advance_split'] = timeit(lambda: advance_split(line), repeat * 100)
+    results['parse_python'] = timeit(lambda: parse('a = [i * 2 for i in range(10)]', context), repeat * 100)
+    results['parse_builtin'] = timeit(lambda: parse('cd $name/${n}', context), repeat * 100)
+    results['replace_vars'] = timeit(lambda: replace_vars('dst/$name/${n}/${missing:-x}/file', context), repeat * 100)
+
+    from ctsh.highlight import Highlighter
+    highlighter = Highlighter(context)
+    long_line = 'cp "some dir/with spaces" dst/$name ${n} ' * 25
+    highlighter.update(long_line)
+    def keystroke():
+        # type a character at the end of a 1000 character line, then delete it
+        for text in (long_line + 'x', long_line):
+            highlighter.render(highlighter.update(text))
+    results['highlight_keystroke_1k'] = timeit(keystroke, repeat * 100)
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        sink = io.StringIO()
+        def run(cmd, *args):
+            sink.seek(0)
+            sink.truncate()
+            with redirect_stdout(sink):
+                cmd(context, *args)
+        ls = context.fallback_commands['ls']
+        du = context.fallback_commands['du']
+        results['ls_10k'] = timeit(lambda: run(ls, 'big'), repeat)
+        results['du_tree'] = timeit(lambda: run(du, 'tree'), repeat)
+    finally:
+        os.chdir(cwd)
+    return results
+
+# ---------------------------------------------------------------------------
+
+def compare(current: dict, baseline: dict, threshold: float) -> bool:
+    """print a comparison table, return True if nothing regressed"""
+    ok = True
+    print(f'{"benchmark":<34}{"baseline":>12}{"current":>12}{"change":>10}')
+    for group, results in current['results'].items():
+        for name, r in results.items():
+            key = f'{group}.{name}'
+            base = baseline['results'].get(group, {}).get(name)
+            if base is None:
+                print(f'{key:<34}{"-":>12}{r["median_ms"]:>10.3f}ms')
+                continue
+            change = r['median_ms'] / base['median_ms'] - 1 if base['median_ms'] else 0
+            flag = ''
+            if change > threshold:
+                flag = '  REGRESSION'
+                ok = False
+            print(f'{key:<34}{base["median_ms"]:>10.3f}ms{r["median_ms"]:>10.3f}ms{change:>+10.1%}{flag}')
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench')
+    parser.add_argument('-o', '--output', help='write results to this json file')
+    parser.add_argument('--compare', help='compare against a baseline json file')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown before failing (default 0.2)')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--no-pty', action='store_true', help='skip the interactive benchmarks')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='ctsh-bench-')
+    try:
+        make_flat(os.path.join(workdir, 'big'), 10000)
+        make_tree(os.path.join(workdir, 'tree'), depth=3, width=4, files=20)
+        results = {'micro': bench_micro(workdir, args.repeat)}
+        if not args.no_pty and sys.platform != 'win32':
+            results['interactive'] = bench_interactive(workdir, args.repeat)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'python': platform.python_version(),
+        'platform': sys.platform,
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results': results,
+    }
+    for group, rs in results.items():
+        for name, r in rs.items():
+            key = f'{group}.{name}'
+            print(f'{key:<34}{r["median_ms"]:>10.3f}ms (p90 {r["p90_ms"]:.3f}ms)')
+    if args.output:
+        with open(args.output, 'wt', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'rt', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print()
+        if not compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
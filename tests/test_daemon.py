@@ -0,0 +1,81 @@
+import os
+import select
+import subprocess
+import sys
+import time
+import pytest
+from ctsh import daemon
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='unix domain sockets')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def server(tmp_path):
+    path = str(tmp_path / 'daemon.sock')
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'ctsh', 'daemon', '--socket', path],
+        env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while not os.path.exists(path):
+        assert proc.poll() is None and time.time() < deadline
+        time.sleep(0.02)
+    yield path
+    try:
+        daemon.request('stop', path)
+    except OSError:
+        pass
+    try:
+        proc.wait(10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+def read_until(frames, needle: bytes, timeout: float = 20):
+    """terminal output up to `needle`, and the events seen meanwhile"""
+    out, events = b'', []
+    deadline = time.time() + timeout
+    while needle not in out:
+        left = deadline - time.time()
+        assert left > 0, out
+        if not select.select([frames], [], [], left)[0]:
+            continue
+        got = frames.recv()
+        assert got is not None, out
+        for kind, payload in got:
+            if kind == b'd':
+                out += payload
+            elif kind == b'e':
+                events.append(payload)
+                out += b'<' + payload + b'>'
+    return out, events
+
+def test_attach_detach_resume(server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('CTSH_TEST_VALUE', 'from-the-client')
+    reply, frames = daemon.open_session('t', server, size=[24, 80], start=False)
+    assert reply['resumed'] is False
+    frames.send(b'd', b'import os; x = 41\r')
+    frames.send(b'd', b'os.environ["CTSH_TEST_VALUE"] + "|" + os.getcwd()\r')
+    out, _ = read_until(frames, b'from-the-client|' + str(tmp_path).encode())
+    frames.send(b'd', b'detach\r')
+    read_until(frames, b'"event": "detached"')
+    frames.close()
+
+    reply, frames = daemon.open_session('t', server, start=False)
+    assert reply['resumed'] is True
+    frames.send(b'd', b'x + 1\r')
+    read_until(frames, b'42')
+    frames.send(b'd', b'exit()\r')
+    read_until(frames, b'"event": "exit"')
+    frames.close()
+    assert daemon.request('list', server)['sessions'] == {}
+
+def test_second_client_is_refused(server):
+    reply, frames = daemon.open_session('busy', server, start=False)
+    try:
+        reply2, frames2 = daemon.open_session('busy', server, start=False)
+        assert frames2 is None and 'already attached' in reply2['error']
+    finally:
+        frames.close()
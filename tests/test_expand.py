@@ -0,0 +1,56 @@
+import glob as std_glob
+import os
+import pytest
+from ctsh.expand import expand_braces, expand_args, glob, IgnoreRules
+
+@pytest.mark.parametrize('s, expected', [
+    ('a{b,c}d', ['abd', 'acd']),
+    ('{1..3}', ['1', '2', '3']),
+    ('{3..1}', ['3', '2', '1']),
+    ('{a..c}', ['a', 'b', 'c']),
+    ('x{a,{b,c}}', ['xa', 'xb', 'xc']),
+    ('{a,b}{1,2}', ['a1', 'a2', 'b1', 'b2']),
+    ('{}', ['{}']),
+    ('{x}', ['{x}']),
+    ('a{b', ['a{b']),
+    ('plain', ['plain']),
+])
+def test_expand_braces(s, expected):
+    assert expand_braces(s) == expected
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.join('a', 'b'))
+    os.makedirs('c')
+    for path in ['x.py', 'y.txt', '.hidden.py', 'a/y.py', 'a/b/z.py', 'c/w.txt']:
+        open(path, 'w').close()
+    return tmp_path
+
+@pytest.mark.parametrize('pattern', [
+    '*', '*.py', '?.txt', '[xy].*', '.*', 'a/*', '*/*.py',
+    '**', '**/', '**/*.py', 'a/**', 'a/**/', 'a/**/*.py', '**/b/*',
+])
+def test_glob_matches_stdlib(tree, pattern):
+    assert glob(pattern) == sorted(std_glob.glob(pattern, recursive=True))
+
+def test_glob_never_yields_empty(tree):
+    assert '' not in glob('**')
+
+def test_expand_args(tree):
+    assert expand_args(['*.py']) == ['x.py']
+    assert expand_args(['"*.py"', "'a b'"]) == ['*.py', 'a b']
+    assert expand_args(['nomatch*']) == ['nomatch*']
+    assert expand_args(['{x,y}.py']) == ['x.py', 'y.py']
+    assert expand_args(['c/*.{py,txt}']) == ['c/*.py', 'c/w.txt']
+    assert expand_args(['-n', '3']) == ['-n', '3']
+
+def test_ignore_rules():
+    rules = IgnoreRules(['*.pyc', 'build/', '/top', '!keep.pyc', 'docs/**/*.md'])
+    assert rules.ignored('a/b.pyc', False)
+    assert not rules.ignored('keep.pyc', False)
+    assert rules.ignored('x/build', True)
+    assert not rules.ignored('x/build', False)
+    assert rules.ignored('top', False)
+    assert not rules.ignored('a/top', False)
+    assert rules.ignored('docs/a/b/c.md', False)
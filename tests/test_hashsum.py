@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import pytest
+from ctsh.commands.base import hashsum, _DigestCache
+
+def write(path, data: bytes, mtime=None):
+    with open(path, 'wb') as f:
+        f.write(data)
+    if mtime is not None:
+        os.utime(path, ns=(mtime, mtime))
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def test_read_manifest(tmp_path):
+    md5 = hashlib.md5(b'x').hexdigest()
+    lines = [
+        f'{sha256(b"a")}  a.txt',
+        f'{md5} *bin.dat',
+        f'\\{sha256(b"b")}  new\\nline\\\\x',
+        f'SHA1 (with space) = {hashlib.sha1(b"c").hexdigest()}',
+        f'\\BLAKE2b (esc\\\\aped) = {hashlib.blake2b(b"d").hexdigest().upper()}',
+        '# comment',
+        '',
+        'not a checksum line',
+        'abc  too-short.txt',
+    ]
+    manifest = tmp_path / 'SUMS'
+    manifest.write_text('\n'.join(lines) + '\n')
+    assert list(hashsum._read_manifest(str(manifest), None)) == [
+        ('sha256', sha256(b'a'), 'a.txt'),
+        ('md5', md5, 'bin.dat'),
+        ('sha256', sha256(b'b'), 'new\nline\\x'),
+        ('sha1', hashlib.sha1(b'c').hexdigest(), 'with space'),
+        ('blake2b', hashlib.blake2b(b'd').hexdigest(), 'esc\\aped'),
+        None,
+        None,
+    ]
+
+def test_algorithm_option_wins(tmp_path):
+    manifest = tmp_path / 'SUMS'
+    manifest.write_text(f'{"0" * 32}  a\nSHA1 (b) = {"0" * 40}\n')
+    assert [e[0] for e in hashsum._read_manifest(str(manifest), 'md5')] == ['md5', 'md5']
+
+def test_hash_and_check(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    write('a.txt', b'hello')
+    write('b.txt', b'world')
+    hashsum()(None, 'a.txt', 'b.txt')
+    out = capsys.readouterr().out
+    assert out == f'{sha256(b"hello")}  a.txt\n{sha256(b"world")}  b.txt\n'
+    write('SUMS', out.encode())
+    hashsum()(None, '-c', 'SUMS')
+    assert capsys.readouterr().out == 'a.txt: OK\nb.txt: OK\n'
+    write('b.txt', b'World')
+    hashsum()(None, '-c', '--quiet', 'SUMS')
+    out = capsys.readouterr().out
+    assert 'a.txt' not in out and 'b.txt: FAILED' in out and '1 computed checksum did NOT match' in out
+
+def test_cache_is_not_reused_after_a_change(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    cache = str(tmp_path / 'cache.json')
+    # files written in the last seconds are not cached, the mtime may not have moved yet
+    old = 1_000_000_000 * 10**9
+    write('a.txt', b'one', mtime=old)
+    hashsum()(None, '--cache', cache, 'a.txt')
+    write('SUMS', capsys.readouterr().out.encode())
+    with open(cache) as f:
+        entries = json.load(f)['entries']
+    key = f'sha256:{os.path.abspath("a.txt")}'
+    assert entries[key][3] == sha256(b'one')
+
+    # a cached digest is trusted while size, mtime and inode match
+    entries[key][3] = 'f' * 64
+    with open(cache, 'w') as f:
+        json.dump({'version': 1, 'entries': entries}, f)
+    hashsum()(None, '-c', '--cache', cache, 'SUMS')
+    assert 'a.txt: FAILED' in capsys.readouterr().out
+
+    # same size, new mtime: the file is read again
+    write('a.txt', b'two', mtime=old + 10**9)
+    hashsum()(None, '-c', '--cache', cache, 'SUMS')
+    assert 'a.txt: FAILED' in capsys.readouterr().out
+    write('a.txt', b'one', mtime=old + 2 * 10**9)
+    hashsum()(None, '-c', '--cache', cache, 'SUMS')
+    assert capsys.readouterr().out == 'a.txt: OK\n'
+    assert _DigestCache(cache).entries[key][3] == sha256(b'one')
+
+def test_fresh_files_are_not_cached(tmp_path):
+    cache = str(tmp_path / 'cache.json')
+    write(str(tmp_path / 'a.txt'), b'new')
+    hashsum()(None, '--cache', cache, str(tmp_path / 'a.txt'))
+    assert _DigestCache(cache).entries == {}
+
+def test_corrupt_cache_is_ignored(tmp_path):
+    cache = tmp_path / 'cache.json'
+    cache.write_text('{not json')
+    assert _DigestCache(str(cache)).entries == {}
+    cache.write_text('[1, 2]')
+    assert _DigestCache(str(cache)).entries == {}
@@ -0,0 +1,102 @@
+import io
+import os
+import tarfile
+import pytest
+from ctsh.commands.base import pack, unpack
+
+def make_tree(root):
+    os.makedirs(os.path.join(root, 'src', 'sub', 'empty'))
+    with open(os.path.join(root, 'src', 'a.txt'), 'w') as f:
+        f.write('hello\n')
+    with open(os.path.join(root, 'src', 'sub', 'big.bin'), 'wb') as f:
+        f.write(os.urandom(3 << 20))
+    for i in range(50):
+        with open(os.path.join(root, 'src', 'sub', f'small{i}.txt'), 'w') as f:
+            f.write(str(i) * i)
+    os.symlink('a.txt', os.path.join(root, 'src', 'link'))
+
+def read_tree(root):
+    out = {}
+    for dirpath, dirs, files in os.walk(root):
+        rel = os.path.relpath(dirpath, root)
+        out[rel] = None
+        for name in files:
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                out[os.path.join(rel, name)] = ('link', os.readlink(path))
+            else:
+                with open(path, 'rb') as f:
+                    out[os.path.join(rel, name)] = f.read()
+    return out
+
+@pytest.mark.parametrize('name', ['out.tar', 'out.tar.gz', 'out.zip'])
+def test_round_trip(tmp_path, monkeypatch, name):
+    monkeypatch.chdir(tmp_path)
+    make_tree('.')
+    pack()(None, name, 'src', '-q', '-j', '2')
+    unpack()(None, name, '-C', 'out', '-q')
+    expected = read_tree('src')
+    got = read_tree(os.path.join('out', 'src'))
+    if name.endswith('.zip'):
+        # zip has no symlinks, the link comes back as a file
+        assert got.pop('./link') in (b'hello\n', b'a.txt')
+        del expected['./link']
+    assert got == expected
+
+def add_symlink(tf, name, target):
+    info = tarfile.TarInfo(name)
+    info.type = tarfile.SYMTYPE
+    info.linkname = target
+    tf.addfile(info)
+
+def add_file(tf, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tf.addfile(info, io.BytesIO(data))
+
+def test_symlink_traversal(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('work')
+    with tarfile.open(os.path.join('work', 'evil.tar'), 'w') as tf:
+        add_symlink(tf, 'a/b/c/x', '../..')
+        add_symlink(tf, 'a/b/c/q', 'x/../..')
+        add_file(tf, 'a/b/c/q/escaped.txt', b'oops')
+        add_symlink(tf, 'up', '..')
+        add_file(tf, 'up/escaped2.txt', b'oops')
+        add_symlink(tf, 'a/self', '.')
+        add_file(tf, 'a/self/ok.txt', b'ok')
+    unpack()(None, os.path.join('work', 'evil.tar'), '-C', os.path.join('work', 'out'), '-q')
+    assert not os.path.exists(os.path.join('work', 'escaped.txt'))
+    assert not os.path.exists('escaped.txt')
+    assert not os.path.exists(os.path.join('work', 'escaped2.txt'))
+    assert not os.path.islink(os.path.join('work', 'out', 'a', 'b', 'c', 'q'))
+    # a link that stays inside the destination is kept
+    assert os.readlink(os.path.join('work', 'out', 'a', 'self')) == '.'
+    with open(os.path.join('work', 'out', 'a', 'ok.txt'), 'rb') as f:
+        assert f.read() == b'ok'
+
+def test_unwritable_archive_is_kept(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    make_tree('.')
+    with open('old.tar', 'wb') as f:
+        f.write(b'keep me')
+    real_open = open
+
+    def deny(path, mode='r', *args, **kwargs):
+        # a read-only file, also when the tests run as root
+        if path == 'old.tar' and 'w' in mode:
+            raise PermissionError(13, 'Permission denied', path)
+        return real_open(path, mode, *args, **kwargs)
+    monkeypatch.setattr('builtins.open', deny)
+    pack()(None, 'old.tar', 'src', '-q')
+    monkeypatch.undo()
+    with open(os.path.join(tmp_path, 'old.tar'), 'rb') as f:
+        assert f.read() == b'keep me'
+    assert 'pack: old.tar: Permission denied' in capsys.readouterr().out
+
+def test_missing_parent_directory(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    make_tree('.')
+    pack()(None, os.path.join('nope', 'out.tar'), 'src', '-q')
+    assert 'No such file or directory' in capsys.readouterr().out
+    assert not os.path.exists('nope')
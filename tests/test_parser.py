@@ -0,0 +1,67 @@
+import pytest
+from ctsh.commands import base
+from ctsh.context import Context
+from ctsh.parser import is_python_block, paste_units, parse, parse_binding, BuiltinQuery
+from ctsh.records import Table
+
+@pytest.fixture
+def context():
+    c = Context()
+    for _, obj in base.__dict__.items():
+        if isinstance(obj, type) and issubclass(obj, base.Command):
+            c.register_command(obj())
+    return c
+
+def test_paste_units():
+    lines = [
+        '@decorator', 'def f(x):', '    if x:', '        return 1', 'else_ = 2',
+        '', 'try:', '    f(1)', 'except Exception:', '    pass', 'ls -l',
+    ]
+    assert paste_units(lines) == [
+        ['@decorator', 'def f(x):', '    if x:', '        return 1'],
+        ['else_ = 2'],
+        ['try:', '    f(1)', 'except Exception:', '    pass'],
+        ['ls -l'],
+    ]
+
+@pytest.mark.parametrize('source, expected', [
+    ('x = 1\ny = x + 1', True),
+    ('def f():\n    return 1\nf()', True),
+    ('1 + 1\n2 + 2', False),
+    ('import os\nls', False),
+    ('x = 1\npwd', False),
+    ('x = 1\nfiles = ls -l', False),
+    ('ls -l\npwd', False),
+])
+def test_is_python_block(context, source, expected):
+    assert is_python_block(source, context) is expected
+
+def test_variable_shadows_builtin(context):
+    context.g['ls'] = 1
+    assert is_python_block('x = 1\nls', context)
+
+def test_parse_binding(context):
+    b = parse_binding('files = ls -l data', context)
+    assert isinstance(b, BuiltinQuery)
+    assert b.name == 'files' and b.args == ['-l', 'data']
+    assert parse_binding('x == ls', context) is None
+    assert parse_binding('x = 1', context) is None
+    assert parse_binding('x = ls.sort()', context) is None
+    # `pwd` has nothing to query
+    assert parse_binding('x = pwd', context) is None
+    # a variable named `ls` keeps the python meaning
+    context.g['ls'] = [1]
+    assert parse_binding('x = ls', context) is None
+    assert not isinstance(parse('x = ls', context), BuiltinQuery)
+
+def test_binding_runs_the_query(context, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'a.txt').write_text('abc')
+    (tmp_path / 'sub').mkdir()
+    parse('files = ls', context)(context)
+    files = context.g['files']
+    assert isinstance(files, Table)
+    assert dict(zip(files['name'], files['is_dir'])) == {'a.txt': 0, 'sub': 1}
+    # the bound table is a snapshot, a later `cd` does not change it
+    monkeypatch.chdir(tmp_path / 'sub')
+    assert sorted(files['name']) == ['a.txt', 'sub']
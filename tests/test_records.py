@@ -0,0 +1,111 @@
+import array
+import pytest
+from ctsh.records import Mask, Column, StrColumn, Table
+
+SCHEMA = [('name', 's'), ('size', 'q'), ('is_dir', 'B')]
+ROWS = [
+    ('b.py', 30, 0),
+    ('a.txt', 10, 0),
+    ('docs', 4096, 1),
+    ('é.md', 10, 0),
+    ('c.py', 30, 0),
+]
+
+@pytest.fixture
+def table():
+    return Table(SCHEMA, iter(ROWS)).load()
+
+def test_load(table):
+    assert len(table) == 5
+    assert table.columns == ['name', 'size', 'is_dir']
+    assert list(table['name']) == [r[0] for r in ROWS]
+    assert isinstance(table['name'], StrColumn)
+    assert table['size'].data.typecode == 'q'
+    assert table[3].name == 'é.md' and table[-1] == ('c.py', 30, 0)
+    assert [tuple(r) for r in table] == ROWS
+
+def test_load_reads_rows_once():
+    rows = iter(ROWS)
+    t = Table(SCHEMA, rows)
+    assert len(t) == 5
+    assert len(t) == 5
+    assert next(rows, None) is None
+
+def test_mask():
+    a, b = Mask([1, 0, 1, 0]), Mask([1, 1, 0, 0])
+    assert (a & b) == Mask([1, 0, 0, 0])
+    assert (a | b) == Mask([1, 1, 1, 0])
+    assert (a ^ b) == Mask([0, 1, 1, 0])
+    assert ~a == Mask([0, 1, 0, 1])
+    assert isinstance(~a, Mask) and isinstance(a & b, Mask)
+    with pytest.raises(ValueError):
+        a & Mask([1])
+
+def test_filter(table):
+    small = table[(table['size'] < 100) & ~table['is_dir']]
+    assert list(small['name']) == ['b.py', 'a.txt', 'é.md', 'c.py']
+    assert list(table[table['is_dir']]['name']) == ['docs']
+    assert list(table[table['name'].endswith('.py')]['size']) == [30, 30]
+    assert list(table[table['name'].match('*.md')]['name']) == ['é.md']
+    assert list(table[table['name'].search(r'^[ab]')]['name']) == ['b.py', 'a.txt']
+    assert list(table[table['name'] == 'docs']['size']) == [4096]
+    with pytest.raises(ValueError):
+        table.filter(Mask([1]))
+
+def test_sort(table):
+    assert list(table.sort('size')['name']) == ['a.txt', 'é.md', 'b.py', 'c.py', 'docs']
+    # ties keep the order of the next key
+    assert list(table.sort(['size', 'name'])['name']) == ['a.txt', 'é.md', 'b.py', 'c.py', 'docs']
+    assert list(table.sort(['size', 'name'], reverse=True)['name']) == ['docs', 'c.py', 'b.py', 'é.md', 'a.txt']
+    assert list(table.sort('name')['size']) == [10, 30, 30, 4096, 10]
+
+def test_slice_and_select(table):
+    assert list(table.head(2)['name']) == ['b.py', 'a.txt']
+    assert list(table[::-2]['name']) == ['c.py', 'docs', 'b.py']
+    sub = table[['size', 'name']]
+    assert sub.columns == ['size', 'name'] and sub[0] == (30, 'b.py')
+    assert table.sum('size') == 4176
+    with pytest.raises(TypeError):
+        table[1.5]
+
+def test_str_column_take_and_compress():
+    col = Table([('s', 's')], [('',), ('ab',), ('ü',), ('cde',)]).load()['s']
+    assert list(col.take([3, 0, 2, 2])) == ['cde', '', 'ü', 'ü']
+    assert list(col.compress(Mask([0, 1, 1, 0]))) == ['ab', 'ü']
+    assert list(col.take([])) == []
+    assert col[-1] == 'cde'
+    with pytest.raises(IndexError):
+        col[4]
+    with pytest.raises(TypeError):
+        col.sum()
+
+def test_surrogates_round_trip():
+    name = b'bad\xff'.decode('utf-8', 'surrogateescape')
+    t = Table([('name', 's')], [(name,)]).load()
+    assert t['name'][0] == name
+
+def test_column():
+    col = Column('n', array.array('q', [3, 1, 2]))
+    assert col.sum() == 6 and col.min() == 1 and col.max() == 3 and col.mean() == 2
+    assert (col >= 2) == Mask([1, 0, 1])
+    assert list(col.take([2, 0])) == [2, 3]
+    assert Column('n', array.array('q')).mean() != Column('n', array.array('q')).mean()
+
+def test_empty(table):
+    empty = Table(SCHEMA, iter(())).load()
+    assert len(empty) == 0
+    assert list(empty) == []
+    assert len(empty.sort(['size', 'name'])) == 0
+    assert len(empty[empty['size'] > 0]) == 0
+    assert empty.sum('size') == 0
+    assert '[0 rows x 3 columns]' in repr(empty)
+    none = table[table['size'] < 0]
+    assert len(none) == 0 and list(none['name']) == []
+    assert len(Table([]).load()) == 0
+
+def test_repr(table):
+    lines = repr(table).splitlines()
+    assert lines[0].split() == ['name', 'size', 'is_dir']
+    assert lines[-1] == '[5 rows x 3 columns]'
+    big = Table([('i', 'q')], ((i,) for i in range(25)))
+    assert '... 5 more rows' in repr(big)
@@ -0,0 +1,43 @@
+import os
+import re
+import pytest
+from ctsh.commands.base import grep, find
+
+def strip(s):
+    return re.sub(r'\033\[[0-9;]*m', '', s)
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.join('d', 'sub'))
+    with open('a.txt', 'w') as f:
+        f.write('foo\nbar baz\nfoo bar\n')
+    with open(os.path.join('d', 'sub', 'b.txt'), 'w') as f:
+        f.write('bar\n')
+    return tmp_path
+
+def test_grep_lines(tree, capsys):
+    grep()(None, '-n', 'bar', 'a.txt')
+    assert strip(capsys.readouterr().out).splitlines() == ['2:bar baz', '3:foo bar']
+
+def test_grep_match_stays_in_one_line(tree, capsys):
+    # `foo\sbar` only matches within the third line, not across the first newline
+    grep()(None, '-c', r'foo\sbar', 'a.txt')
+    assert capsys.readouterr().out.strip() == '1'
+    grep()(None, r'o[^x]+b', 'a.txt')
+    assert strip(capsys.readouterr().out).splitlines() == ['foo bar']
+    grep()(None, '-c', r'\n', 'a.txt')
+    assert capsys.readouterr().out.strip() == '0'
+
+def test_grep_recursive_skips_links(tree, capsys):
+    os.symlink('d', 'linked_dir')
+    os.symlink('a.txt', 'linked_file')
+    grep()(None, '-r', '-l', 'bar')
+    assert sorted(capsys.readouterr().out.split()) == ['./a.txt', './d/sub/b.txt']
+    # a link named on the command line is followed
+    grep()(None, '-l', 'bar', 'linked_file')
+    assert capsys.readouterr().out.split() == ['linked_file']
+
+def test_find(tree, capsys):
+    find()(None, '.', '-type', 'f', '-name', '*.txt')
+    assert sorted(capsys.readouterr().out.split()) == ['./a.txt', './d/sub/b.txt']
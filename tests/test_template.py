@@ -0,0 +1,75 @@
+import os
+import pytest
+from ctsh.context import Context
+from ctsh.template import Template, SubstitutionError, compile_template, Var, VarDefault, Expr
+
+@pytest.fixture
+def context():
+    c = Context()
+    c.g.update(name='world', n=3, empty='')
+    return c
+
+@pytest.mark.parametrize('s, expected', [
+    ('hello $name', 'hello world'),
+    ('${name}s', 'worlds'),
+    ('${missing:-none} ${empty:-blank} ${name:-x}', 'none blank world'),
+    ('${n * 2}', '6'),
+    ('$$ and ${} and $', '$$ and ${} and $'),
+    ('${#v}', '${#v}'),
+    ('no vars', 'no vars'),
+])
+def test_render(context, s, expected):
+    assert Template(s).render(context) == expected
+
+def test_segments():
+    t = Template('a $x ${y:-1} ${x + 1} ${v%%}')
+    kinds = [type(seg) for seg in t.segments]
+    assert kinds == [str, Var, str, VarDefault, str, Expr, str]
+    assert t.segments[-1] == ' ${v%%}'
+    assert not Template('plain').has_vars
+
+def test_missing_variable(context):
+    with pytest.raises(KeyError):
+        Template('$missing').render(context)
+    with pytest.raises(SubstitutionError):
+        Template('${1 / 0}').render(context)
+
+@pytest.mark.parametrize('s', ['${v%suffix}', '${v/a/b}', '${v-default}', '${#v}', '${n * 2}'])
+def test_shell_keeps_bash_expansions(context, s):
+    assert Template(s, exprs=False).render(context) == s
+
+def test_shell_substitutes_names(context):
+    assert Template('echo $name ${n} ${missing:-x}', exprs=False).render(context) == 'echo world 3 x'
+
+def test_compile_template_cache():
+    assert compile_template('$a') is compile_template('$a')
+    assert compile_template('${a-b}') is not compile_template('${a-b}', False)
+
+def test_get_cache(context, monkeypatch):
+    monkeypatch.setenv('CTSH_TEST_VAR', 'one')
+    assert context.get('CTSH_TEST_VAR') == 'one'
+    # environment lookups are cached until `invalidate`
+    monkeypatch.setenv('CTSH_TEST_VAR', 'two')
+    assert context.get('CTSH_TEST_VAR') == 'one'
+    context.invalidate()
+    assert context.get('CTSH_TEST_VAR') == 'two'
+    # misses are cached too
+    assert context.get('CTSH_TEST_NEW') is Context.DoesNotExist
+    os.environ['CTSH_TEST_NEW'] = 'x'
+    try:
+        assert context.get('CTSH_TEST_NEW') is Context.DoesNotExist
+        context.invalidate()
+        assert context.get('CTSH_TEST_NEW') == 'x'
+    finally:
+        del os.environ['CTSH_TEST_NEW']
+
+def test_get_sees_globals_immediately(context):
+    assert context.get('len') is len
+    # `g` shadows builtins without an `invalidate`, as `exec` writes it directly
+    context.g['len'] = 5
+    assert context.get('len') == 5
+    del context.g['len']
+    assert context.get('len') is len
+    assert context['name'] == 'world'
+    with pytest.raises(KeyError):
+        context['missing']